@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from xmltotabular import XmlCollectionToTabular
+from xmltotabular.doc_index import load_doc_index, read_indexed_doc
+from xmltotabular.utils import get_index_path, read_index, yield_xml_doc
+
+
+XML_PATH = Path("tests/test_xml_files/multiple_simple_docs.xml")
+
+
+def copy_to_tempdir(path):
+    copy = Path(tempfile.mkdtemp()) / path.name
+    shutil.copy(path, copy)
+    return copy
+
+
+def test_doc_index_sidecar():
+    xml_path = copy_to_tempdir(XML_PATH)
+    index_path = get_index_path(xml_path, ".docidx")
+
+    entries = load_doc_index(xml_path)
+    assert [entry.linenum for entry in entries] == [0, 8, 16]
+    assert len({entry.digest for entry in entries}) == 3
+    assert read_index(index_path, xml_path)["docs"] == [list(e) for e in entries]
+    assert load_doc_index(xml_path) == entries
+
+    assert read_indexed_doc(xml_path, 2) == list(yield_xml_doc(xml_path))[2]["doc"]
+
+    # the index is stale once the file has been modified
+    os.utime(xml_path, (0, 0))
+    assert read_index(index_path, xml_path) is None
+
+
+def test_doc_index_in_cache_dir(simple_config):
+    xml_path = copy_to_tempdir(XML_PATH)
+    index_dir = Path(tempfile.mkdtemp())
+
+    collectionTransformer = XmlCollectionToTabular(
+        str(xml_path),
+        simple_config,
+        ":memory:",
+        "sqlite",
+        processes=1,
+        batch_size=2,
+        doc_index=True,
+        index_dir=index_dir,
+    )
+
+    db = collectionTransformer.convert()
+
+    assert db.execute("SELECT name FROM album;").fetchall() == [
+        ("Five Leaves Left",),
+        ("Bryter Layter",),
+        ("Pink Moon",),
+    ]
+    assert [path.suffix for path in index_dir.iterdir()] == [".docidx"]
+    assert not get_index_path(xml_path, ".docidx").exists()
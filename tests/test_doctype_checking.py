@@ -2,6 +2,7 @@ import pytest
 import yaml
 
 from xmltotabular import XmlDocToTabular
+from xmltotabular import utils
 from xmltotabular.utils import WrongDoctypeException, NoDoctypeException
 
 
@@ -236,3 +237,30 @@ def test_no_doctype_not_raised_when_continue_on_error():
 
     docTransformer = XmlDocToTabular(config, check_doctype=True, continue_on_error=True)
     assert docTransformer.process_doc(xml) == {}
+
+
+def test_doctype_checking_on_bytes():
+    xml = b"""\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE wrong_elem SYSTEM "albums.dtd" [ ]>
+<albums />
+    """
+
+    assert utils.test_doctype(xml.replace(b"wrong_elem", b"albums"), "albums")
+    with pytest.raises(WrongDoctypeException, match="wrong_elem"):
+        utils.test_doctype(xml, "albums")
+    with pytest.raises(NoDoctypeException):
+        utils.test_doctype(b"<?xml version='1.0'?><albums />", "albums")
+
+
+def test_doctype_checking_reads_only_the_prolog():
+    prolog = b"""\
+\xef\xbb\xbf<?xml version="1.0" encoding="UTF-8"?>
+<?xml-stylesheet href="albums.xsl"?>
+<!-- a comment mentioning <!DOCTYPE wrong_elem> -->
+"""
+
+    assert utils.test_doctype(prolog + b"<!DOCTYPE albums>\n<albums />", "albums")
+    # a DOCTYPE declaration after the root element's start tag isn't in the prolog
+    with pytest.raises(NoDoctypeException):
+        utils.test_doctype(prolog + b"<albums>\n<!DOCTYPE albums>\n</albums>", "albums")
@@ -0,0 +1,71 @@
+import gzip
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+
+from xmltotabular.gzip_index import (
+    load_gzip_index,
+    split_gzip_range,
+    yield_gzip_ranges,
+)
+from xmltotabular.utils import iter_xml_docs
+
+
+XML_PATH = Path("tests/test_xml_files/multiple_simple_docs.xml")
+
+
+def write_multi_member_gzip(data, member_size, bgzf=False):
+    """Compress `data` as a series of gzip members of (uncompressed) `member_size`."""
+    gz_path = Path(tempfile.mkdtemp()) / "docs.xml.gz"
+    with gz_path.open("wb") as _fh:
+        for i in range(0, len(data), member_size):
+            chunk = data[i : i + member_size]
+            if not bgzf:
+                _fh.write(gzip.compress(chunk))
+                continue
+            compressor = zlib.compressobj(wbits=-15)
+            deflated = compressor.compress(chunk) + compressor.flush()
+            block_size = 18 + len(deflated) + 8
+            _fh.write(
+                b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+                + struct.pack("<H", block_size - 1)
+                + deflated
+                + struct.pack("<II", zlib.crc32(chunk), len(chunk))
+            )
+    return gz_path
+
+
+def test_gzip_ranges_split_like_the_whole_file():
+    data = XML_PATH.read_bytes()
+
+    # members (and ranges) deliberately don't align with document boundaries
+    gz_path = write_multi_member_gzip(data, member_size=37)
+
+    gzip_ranges = list(yield_gzip_ranges(gz_path, range_bytes=100))
+    assert len(gzip_ranges) > 1
+
+    assert [
+        doc_info
+        for gzip_range in gzip_ranges
+        for doc_info in split_gzip_range(gzip_range)
+    ] == list(iter_xml_docs(XML_PATH))
+
+
+def test_bgzf_is_indexed_without_decompressing():
+    data = XML_PATH.read_bytes()
+    gz_path = write_multi_member_gzip(data, member_size=100, bgzf=True)
+
+    members, length = load_gzip_index(gz_path)
+    assert length == len(data)
+    assert [member.decompressed_offset for member in members] == list(
+        range(0, len(data), 100)
+    )
+    assert gz_path.with_name("docs.xml.gz.gzidx").exists()
+
+    docs = [
+        doc
+        for gzip_range in yield_gzip_ranges(gz_path, range_bytes=150)
+        for _start, _end, _linenum, doc in split_gzip_range(gzip_range)
+    ]
+    assert docs == [doc for _start, _end, _linenum, doc in iter_xml_docs(XML_PATH)]
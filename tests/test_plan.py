@@ -0,0 +1,81 @@
+import yaml
+
+from xmltotabular import plan
+from xmltotabular.plan import compile_plan
+
+
+def test_compile_plan():
+    config = yaml.safe_load(
+        r"""
+        <root_element>: albums
+        album:
+          <entity>: album
+          <primary_key>: name
+          <fields>:
+            name: name
+            artist:
+              <fieldname>: artist
+            track:
+              <fieldname>: tracks
+              <joiner>: "; "
+            "@format":
+              - <fieldname>: format
+                <enum_map>:
+                  LP: vinyl
+              - <fieldname>: kind
+                <enum_type>: album
+        """
+    )
+
+    extraction_plan = compile_plan(config, {"_": "http://example.com/albums"})
+
+    (album,) = extraction_plan.paths
+    assert album.path == "_:album"
+    assert not album.warn_on_multiple
+    assert album.action.kind == plan.ENTITY
+    assert [expression for expression, _ in album.action.primary_key] == ["_:name"]
+
+    name, artist, track, format_ = album.action.fields
+    assert name.warn_on_multiple
+    assert (name.action.kind, name.action.fieldname) == (plan.FIELD, "name")
+    assert (artist.action.kind, artist.action.fieldname) == (plan.FIELD, "artist")
+    assert (track.action.kind, track.action.value) == (plan.JOINER, "; ")
+    assert format_.path == "@format"
+    assert [action.kind for action in format_.action.actions] == [
+        plan.ENUM_MAP,
+        plan.ENUM_TYPE,
+    ]
+
+    assert extraction_plan.fieldnames == {
+        "album": ["id", "name", "artist", "tracks", "format", "kind"]
+    }
+
+
+def test_paths_sharing_a_parent_are_factored():
+    config = yaml.safe_load(
+        r"""
+        album:
+          <entity>: album
+          <fields>:
+            details/name: name
+            details/artist: artist
+            details/@format: format
+            label/name: label
+            tracks/track[1]/title: first_track
+            tracks/track: track
+        """
+    )
+
+    extraction_plan = compile_plan(config, {"_": "http://example.com/albums"})
+
+    name, artist, format_, label, first_track, track = extraction_plan.paths[
+        0
+    ].action.fields
+    assert name.factored.prefix == "_:details"
+    assert name.factored.leaf == "{http://example.com/albums}name"
+    assert artist.factored.prefix_xpath is name.factored.prefix_xpath
+    assert (format_.factored.leaf, format_.factored.is_attribute) == ("format", True)
+    # only simple paths whose parent is shared are factored
+    assert label.factored is None
+    assert first_track.factored is None
+    assert track.factored is None
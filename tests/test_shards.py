@@ -0,0 +1,98 @@
+import csv
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from xmltotabular import XmlCollectionToTabular
+from xmltotabular.shards import merge_csv_dirs, merge_sqlite_dbs
+
+
+def write_xml_files(dirpath, num_files=3, docs_per_file=5):
+    for file_num in range(num_files):
+        (dirpath / f"albums_{file_num}.xml").write_text(
+            "".join(
+                f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f"<album><name>Album {file_num}.{doc_num}</name></album>\n"
+                for doc_num in range(docs_per_file)
+            )
+        )
+
+
+@pytest.mark.parametrize("shard_by", ["ordinal", "hash"])
+def test_sharded_sqlite_runs_merge_to_the_whole(simple_config, shard_by):
+    tmpdir = Path(tempfile.mkdtemp())
+    write_xml_files(tmpdir, num_files=3, docs_per_file=6)
+
+    shard_paths = []
+    for shard_index in range(3):
+        shard_path = tmpdir / f"shard_{shard_index}.sqlite"
+        XmlCollectionToTabular(
+            str(tmpdir),
+            simple_config,
+            shard_path,
+            "sqlite",
+            processes=1,
+            shard_index=shard_index,
+            shard_count=3,
+            shard_by=shard_by,
+        ).convert()
+        shard_paths.append(shard_path)
+
+    shard_names = [
+        {name for name, in sqlite3.connect(path).execute("SELECT name FROM album;")}
+        for path in shard_paths
+    ]
+    # shards are disjoint (and, by ordinal, balanced)
+    assert sum(map(len, shard_names)) == len(set.union(*shard_names)) == 18
+    if shard_by == "ordinal":
+        assert list(map(len, shard_names)) == [6, 6, 6]
+
+    merged_path = tmpdir / "merged.sqlite"
+    merge_sqlite_dbs(merged_path, shard_paths)
+
+    assert sorted(
+        name for name, in sqlite3.connect(merged_path).execute("SELECT name FROM album;")
+    ) == sorted(f"Album {i}.{j}" for i in range(3) for j in range(6))
+
+
+def test_sharding_with_doc_index_selects_the_same_documents(simple_config):
+    tmpdir = Path(tempfile.mkdtemp())
+    write_xml_files(tmpdir, num_files=1, docs_per_file=7)
+
+    def shard_names(doc_index):
+        db = XmlCollectionToTabular(
+            str(tmpdir / "albums_0.xml"),
+            simple_config,
+            ":memory:",
+            "sqlite",
+            processes=1,
+            shard_index=1,
+            shard_count=2,
+            doc_index=doc_index,
+            index_dir=tmpdir,
+        ).convert()
+        return db.execute("SELECT name FROM album;").fetchall()
+
+    assert shard_names(doc_index=True) == shard_names(doc_index=False)
+
+
+def test_merge_csv_dirs():
+    tmpdir = Path(tempfile.mkdtemp())
+    for shard_index, (header, rows) in enumerate(
+        [
+            ("id,name\n", "1,Pink Moon\n"),
+            ("id,name,genre\n", "2,Bryter Layter,Folk\n"),
+        ]
+    ):
+        (tmpdir / f"shard_{shard_index}").mkdir()
+        (tmpdir / f"shard_{shard_index}" / "album.csv").write_text(header + rows)
+
+    merge_csv_dirs(tmpdir / "merged", [tmpdir / "shard_0", tmpdir / "shard_1"])
+
+    with (tmpdir / "merged" / "album.csv").open() as _fh:
+        assert list(csv.DictReader(_fh)) == [
+            {"id": "1", "name": "Pink Moon"},
+            {"id": "2", "name": "Bryter Layter"},
+        ]
@@ -260,3 +260,70 @@ def test_error_if_too_many_vars(empty_db, num_rows):
     empty_db["too-many-vars"].create({"c": str})
     rows = [{"c": i} for i in range(num_rows)]
     empty_db["too-many-vars"].insert_all(rows)
+
+
+def test_schema_cache_is_invalidated_by_add_column(empty_db):
+    table = empty_db["album"].create({"name": str})
+    assert table.column_names == ("name",)
+
+    table.add_column("artist", str)
+    assert empty_db["album"].column_names == ("name", "artist")
+
+    table.insert_all([{"name": "Pink Moon", "artist": "Nick Drake"}])
+    assert empty_db.execute("SELECT * FROM album;").fetchall() == [
+        ("Pink Moon", "Nick Drake")
+    ]
+
+
+def test_executemany_insert_engine_accepts_generators():
+    db = SqliteDB(":memory:", insert_engine="executemany")
+    num_columns = 10
+    num_rows = 1000
+
+    db["test-table"].create({f"column_{col:02}": str for col in range(num_columns)})
+
+    db["test-table"].insert_all(
+        {f"column_{col:02}": f"data_{row:03}_{col:02}" for col in range(num_columns)}
+        for row in range(num_rows)
+    )
+
+    assert db.execute("SELECT * FROM 'test-table';").fetchall() == [
+        tuple(f"data_{row:03}_{col:02}" for col in range(num_columns))
+        for row in range(num_rows)
+    ]
+
+
+@pytest.mark.parametrize("insert_engine", ["multi_values", "executemany"])
+def test_insert_all_with_rows_as_tuples(insert_engine):
+    db = SqliteDB(":memory:", insert_engine=insert_engine)
+    db["album"].create({"name": str, "artist": str, "released": str})
+
+    db["album"].insert_all(
+        [("1969", "Five Leaves Left"), ("1972", "Pink Moon")] * 1000,
+        column_names=("released", "name"),
+    )
+
+    assert db.execute("SELECT * FROM album LIMIT 2;").fetchall() == [
+        ("Five Leaves Left", None, "1969"),
+        ("Pink Moon", None, "1972"),
+    ]
+    assert db.execute("SELECT count(*) FROM album;").fetchone() == (2000,)
+
+
+def test_multi_values_insert_engine_converts_records_batch_by_batch(empty_db):
+    table = empty_db["album"].create({"name": str, "released": str})
+    consumed = []
+
+    def records():
+        for row in range(1000):
+            consumed.append(row)
+            yield {"name": f"album_{row:03}", "released": str(1969 + row % 4)}
+
+    # (two columns to a row, so 499 rows to a batch)
+    batches = table.generate_insert_batches(records())
+    sql, params = next(batches)
+    assert len(params) == 2 * 499 and len(consumed) == 499
+
+    for sql, params in batches:
+        empty_db.execute(sql, params)
+    assert len(consumed) == 1000
@@ -0,0 +1,274 @@
+import pytest
+import yaml
+
+from xmltotabular import XmlDocToTabular
+from xmltotabular.plan import compile_plan
+from xmltotabular.streaming import (
+    STREAM_CHUNK_BYTES,
+    compile_record_path,
+    is_streamable,
+)
+
+
+ALBUM_XML = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE album [ <!ENTITY label "Island Records"> ]>
+<album id="ILPS 9105" format="LP">
+  <name>Five <i>Leaves</i> Left</name>
+  <artist>Nick Drake</artist>
+  <label>&label;</label>
+  <genre>Folk</genre>
+  <genre>Baroque <!-- really? --> pop</genre>
+  <description>
+    <p>Recorded <b>1968-1969</b> at Sound Techniques</p> and mixed
+    <p>Released on <![CDATA[Island]]></p>
+  </description>
+  <tracks>
+    <track n="1"><title>Time Has Told Me</title>
+      <credit role="strings">Kirby</credit></track>
+    <track n="2"><title>River Man</title><credit role="strings">Robinson</credit>
+      <credit role="bass">Danny Thompson</credit></track>
+    <track n="3"><title>Three Hours</title></track>
+  </tracks>
+  <personnel>
+    <credit role="guitar">Richard Thompson</credit>
+  </personnel>
+</album>
+"""
+
+CASES = {
+    "fields_and_tails": """
+        album:
+          <entity>: album
+          <primary_key>: "@id"
+          <fields>:
+            name: name
+            "@format": format
+            label: label
+            description: description
+            description/p:
+              <fieldname>: paragraphs
+              <joiner>: " | "
+        """,
+    "multiple_results_last_wins": """
+        album:
+          <entity>: album
+          <fields>:
+            genre: genre
+            tracks/track/title: last_title
+        """,
+    "nested_entities_and_auto_ids": """
+        album:
+          <entity>: album
+          <primary_key>: "@id"
+          <fields>:
+            name: name
+            tracks/track:
+              <entity>: track
+              <fields>:
+                "@n": number
+                title: title
+                credit:
+                  <entity>: credit
+                  <fields>:
+                    "@role": role
+                    credit: name
+            personnel/credit:
+              <entity>: credit
+              <fields>:
+                "@role": role
+                credit: name
+        """,
+    "entity_primary_keys": """
+        album:
+          <entity>: album
+          <primary_key>: [name, artist]
+          <fields>:
+            tracks/track:
+              <entity>: track
+              <primary_key>: "@n"
+              <fields>:
+                title: title
+                credit/@role:
+                  <fieldname>: roles
+                  <joiner>: ","
+        """,
+    "enums_and_multiple_configs": """
+        album:
+          <entity>: album
+          <fields>:
+            "@format":
+              - <fieldname>: format
+                <enum_map>:
+                  LP: long-player
+                  EP: extended-play
+              - format_code
+            genre:
+              <fieldname>: has_genre
+              <enum_type>: "yes"
+            tracks/track/title:
+              - <fieldname>: titles
+                <joiner>: "; "
+              - last_title
+        """,
+    "top_level_paths": """
+        tracks/track:
+          <entity>: track
+          <fields>:
+            title: title
+        personnel:
+          <entity>: personnel
+          <fields>:
+            credit: name
+        """,
+}
+
+
+def albums_xml(count=100):
+    """Return a document of `count` albums (i.e. records), larger than a chunk."""
+    prolog, album = ALBUM_XML.split("<album ")
+    xml = (
+        prolog.replace("DOCTYPE album", "DOCTYPE albums")
+        + "<albums>\n"
+        + "".join(
+            "<album " + album.replace("ILPS 9105", f"ILPS {9105 + n}")
+            for n in range(count)
+        )
+        + "</albums>\n"
+    )
+    assert len(xml) > STREAM_CHUNK_BYTES
+    return xml
+
+
+ALBUMS_XML = albums_xml()
+
+# (the top-level paths of this case are found from each album, rather than the root)
+RECORD_CASES = [case for case in CASES if case != "top_level_paths"]
+
+
+def process(config, xml, engine, **kwargs):
+    return XmlDocToTabular(yaml.safe_load(config), engine=engine, **kwargs).process_doc(
+        xml
+    )
+
+
+class RecordWatchingDocToTabular(XmlDocToTabular):
+    """Notes whether each album is preceded by any other as it's processed."""
+
+    def process_new_entity(self, elem, action, *args):
+        if action.entity == "album":
+            self.preceded.append(elem.getprevious() is not None)
+        super().process_new_entity(elem, action, *args)
+
+
+@pytest.mark.parametrize("case", RECORD_CASES)
+def test_stream_engine_matches_tree_engine(case):
+    docTransformer = RecordWatchingDocToTabular(
+        yaml.safe_load(CASES[case]), engine="stream"
+    )
+    docTransformer.preceded = []
+    tables = docTransformer.process_doc(ALBUMS_XML)
+
+    assert tables
+    assert tables == process(CASES[case], ALBUMS_XML, "tree")
+    # the records were processed as they were parsed, each one removed from the tree
+    #  before the next
+    assert docTransformer.preceded == [False] * 100
+
+
+@pytest.mark.parametrize("case", ["fields_and_tails", "nested_entities_and_auto_ids"])
+def test_stream_engine_matches_tree_engine_with_namespaces(case):
+    for xml in (
+        ALBUMS_XML.replace("<albums>", '<albums xmlns="http://example.com/albums">'),
+        ALBUMS_XML.replace("<tracks>", '<tracks xmlns:ex="http://example.com/tracks">'),
+    ):
+        assert process(CASES[case], xml, "stream") == process(CASES[case], xml, "tree")
+
+
+def test_stream_engine_matches_tree_engine_for_bytes():
+    xml = ALBUMS_XML.replace("UTF-8", "ISO-8859-1").replace("Drake", "Dr\xe4ke")
+    xml = xml.encode("iso-8859-1")
+
+    config = CASES["fields_and_tails"]
+    assert process(config, xml, "stream") == process(config, xml, "tree")
+
+
+def test_warnings_for_multiple_results_match(caplog):
+    config = CASES["multiple_results_last_wins"]
+
+    process(config, ALBUMS_XML, "tree")
+    tree_warnings = caplog.messages[:]
+    caplog.clear()
+    process(config, ALBUMS_XML, "stream")
+
+    assert tree_warnings and caplog.messages == tree_warnings
+
+
+def test_streamable_configs():
+    for case in CASES:
+        assert is_streamable(compile_plan(yaml.safe_load(CASES[case]), {}))
+
+    for path in ("tracks//title", "track[1]/title", "../name", "text()", "*/title"):
+        assert not is_streamable(compile_plan({path: "x"}, {}))
+
+
+def test_record_paths():
+    def get_record_path(config):
+        return compile_record_path(compile_plan(yaml.safe_load(config), {}))
+
+    assert get_record_path(CASES["fields_and_tails"]).steps == ("album",)
+    assert get_record_path("albums/album: {<entity>: album, <fields>: {name: name}}")
+    # more than one top-level path
+    assert get_record_path(CASES["top_level_paths"]) is None
+    # not an entity
+    assert get_record_path("album: name") is None
+    # a field whose text includes the tail of the record
+    assert get_record_path("album: {<entity>: album, <fields>: {album: text}}") is None
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        CASES["top_level_paths"].replace("tracks/track", "album/tracks/track"),
+        """
+        album:
+          <entity>: album
+          <fields>:
+            name: name
+            tracks/track[@n="2"]/title: second_title
+        """,
+        """
+        album:
+          <entity>: album
+          <fields>:
+            album: text
+        """,
+    ],
+)
+def test_stream_engine_falls_back_to_tree_engine(config):
+    tables = process(config, ALBUMS_XML, "stream")
+
+    assert tables and tables == process(config, ALBUMS_XML, "tree")
+
+
+def test_stream_engine_with_a_single_record():
+    # the top-level path refers to the root element itself
+    xml = ALBUM_XML.replace("</album>", f"<!-- {'x' * STREAM_CHUNK_BYTES} --></album>")
+
+    config = CASES["nested_entities_and_auto_ids"]
+    assert process(config, xml, "stream") == process(config, xml, "tree")
+
+
+def test_stream_engine_with_malformed_documents():
+    config = CASES["fields_and_tails"]
+    xml = ALBUMS_XML.replace("</albums>", "<album>")
+    with pytest.raises(SystemExit):
+        process(config, xml, "stream")
+
+    # rows taken from the document before the error are discarded
+    assert not process(config, xml, "stream", continue_on_error=True)
+
+    # undecodable bytes (here, in the last album) are replaced, as by the tree engine
+    head, tail = ALBUMS_XML.rsplit("Danny", 1)
+    xml = (head + "Da\udcffnny" + tail).encode("utf8", errors="surrogateescape")
+    assert process(config, xml, "stream") == process(config, xml, "tree")
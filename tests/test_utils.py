@@ -0,0 +1,182 @@
+import bz2
+import gzip
+import io
+import lzma
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from xmltotabular.utils import (
+    ReadAheadStream,
+    is_mappable,
+    batch_payloads,
+    get_batch_bytes,
+    split_xml_docs,
+    split_xml_stream,
+    yield_xml_doc,
+    yield_xml_doc_offsets,
+    read_xml_doc,
+    DocFilter,
+    BackgroundWriter,
+    iterparse_records,
+    BATCH_BYTES,
+)
+
+
+XML_PATH = Path("tests/test_xml_files/multiple_simple_docs.xml")
+
+
+def test_split_xml_docs():
+    buffer = XML_PATH.read_bytes()
+
+    offsets = list(split_xml_docs(buffer))
+
+    assert [linenum for _start, _end, linenum in offsets] == [0, 8, 16]
+    assert offsets[0][0] == 0 and offsets[-1][1] == len(buffer)
+    assert all(
+        buffer[start:end].startswith(b"<?xml ") for start, end, _linenum in offsets
+    )
+    assert b"".join(buffer[start:end] for start, end, _linenum in offsets) == buffer
+
+
+def test_split_xml_docs_without_newlines_between_docs():
+    buffer = b'<?xml version="1.0"?><a/><?xml version="1.0"?><b/>\n'
+
+    assert [buffer[start:end] for start, end, _ in split_xml_docs(buffer)] == [
+        b'<?xml version="1.0"?><a/>',
+        b'<?xml version="1.0"?><b/>\n',
+    ]
+
+
+def test_split_xml_stream_matches_split_xml_docs():
+    buffer = XML_PATH.read_bytes()
+
+    with XML_PATH.open("rb") as _fh:
+        # a tiny chunk size, so that declarations straddle chunk boundaries
+        streamed = list(split_xml_stream(_fh, chunk_size=7))
+
+    assert [(start, end, linenum) for start, end, linenum, _ in streamed] == list(
+        split_xml_docs(buffer)
+    )
+    assert [doc for _, _, _, doc in streamed] == [
+        buffer[start:end] for start, end, _ in split_xml_docs(buffer)
+    ]
+
+
+def test_yield_xml_doc_from_gzipped_file():
+    gz_path = Path(tempfile.mkdtemp()) / "docs.xml.gz"
+    with gzip.open(gz_path, "wb") as _fh:
+        _fh.write(XML_PATH.read_bytes())
+
+    assert [payload["doc"] for payload in yield_xml_doc(gz_path)] == [
+        payload["doc"] for payload in yield_xml_doc(XML_PATH)
+    ]
+
+
+def test_read_xml_doc_from_offsets():
+    docs = [payload["doc"] for payload in yield_xml_doc(XML_PATH)]
+
+    assert [
+        read_xml_doc(XML_PATH, start, end)
+        for start, end, _linenum in yield_xml_doc_offsets(XML_PATH)
+    ] == docs
+
+
+def test_empty_file():
+    empty_path = Path(tempfile.mkdtemp()) / "empty.xml"
+    empty_path.touch()
+
+    assert list(yield_xml_doc(empty_path)) == []
+
+
+def test_batch_payloads():
+    payloads = [{"doc": b"x" * size} for size in (10, 10, 10, 30, 10)]
+
+    assert [len(batch) for batch in batch_payloads(payloads, batch_size=2)] == [2, 2, 1]
+    assert [len(batch) for batch in batch_payloads(payloads, batch_bytes=25)] == [
+        3,
+        1,
+        1,
+    ]
+
+
+def test_get_batch_bytes():
+    # small inputs are spread across several batches per worker
+    assert get_batch_bytes(800_000, 4) == 50_000
+    assert get_batch_bytes(10, 4) == 1
+    # ... and large ones are batched up to BATCH_BYTES
+    assert get_batch_bytes(1 << 30, 4) == BATCH_BYTES
+
+
+@pytest.mark.parametrize("compress", (gzip.compress, bz2.compress, lzma.compress))
+def test_yield_xml_doc_from_compressed_file(compress):
+    compressed_path = Path(tempfile.mkdtemp()) / "docs.xml.compressed"
+    compressed_path.write_bytes(compress(XML_PATH.read_bytes()))
+
+    assert not is_mappable(compressed_path)
+    assert [payload["doc"] for payload in yield_xml_doc(compressed_path)] == [
+        payload["doc"] for payload in yield_xml_doc(XML_PATH)
+    ]
+
+
+def test_iterparse_records_excludes_text_between_records():
+    stream = io.BytesIO(
+        b"<albums><album><name>Pink Moon</name></album>, "
+        b"<album><name>Bryter Layter</name></album> &amp; more</albums>"
+    )
+
+    assert [
+        payload["doc"] for payload in iterparse_records(stream, "albums.xml", "album")
+    ] == [
+        b"<album><name>Pink Moon</name></album>",
+        b"<album><name>Bryter Layter</name></album>",
+    ]
+
+
+def test_read_ahead_stream():
+    data = XML_PATH.read_bytes()
+
+    with ReadAheadStream(io.BytesIO(data), chunk_size=10, depth=2) as stream:
+        assert stream.read(3) + stream.read(25) + stream.read() == data
+        assert stream.read(1) == b""
+
+
+def test_read_ahead_stream_raises_errors_in_the_consumer():
+    with pytest.raises(OSError):
+        with ReadAheadStream(bz2.BZ2File(io.BytesIO(b"BZh9 not bz2 data"))) as stream:
+            stream.read()
+
+
+def test_doc_filter():
+    doc = b"""<?xml version="1.0"?>
+<grant kind="B1">
+<title>Widget (a+b)</title>
+</grant>"""
+
+    assert DocFilter('kind="B[12]"').matches(doc)
+    assert not DocFilter('kind="A[12]"').matches(doc)
+    assert DocFilter({"<literal>": ["(a+b)", "nothing"]}).matches(doc)
+    assert DocFilter({"<literal>": "(a+b)", "<exclude>": True}).matches(doc) is False
+    assert not DocFilter({"<literal>": "(a+b)", "<head_bytes>": 40}).matches(doc)
+    assert DocFilter({"<pattern>": "<grant kind=", "<head_bytes>": 40}).matches(doc)
+    assert DocFilter('kind="B1"').matches(doc.decode("utf8"))
+    with pytest.raises(ValueError):
+        DocFilter({"<head_bytes>": 40})
+
+
+def test_background_writer():
+    written = []
+    writer = BackgroundWriter(written.append, depth=1)
+    for item in range(10):
+        writer.put(item)
+    writer.close()
+    assert written == list(range(10))
+
+    def fail(item):
+        raise ValueError(item)
+
+    writer = BackgroundWriter(fail)
+    writer.put(1)
+    with pytest.raises(ValueError):
+        writer.close()
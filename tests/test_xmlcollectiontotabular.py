@@ -1,7 +1,21 @@
+import csv
+import gzip
 import logging
 import sqlite3
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
 
 from xmltotabular import XmlCollectionToTabular
+from xmltotabular.gzip_index import yield_gzip_ranges
+from xmltotabular.xmlcollectiontotabular import (
+    PartWriter,
+    init_worker,
+    process_gzip_range_in_worker,
+)
 
 
 def test_multiple_docs_in_one_file(simple_config):
@@ -97,3 +111,457 @@ def test_multiple_docs_in_multiple_files(simple_config):
             },
         ]
     )
+
+
+def test_batched_dispatch(simple_config):
+
+    xml_path = "tests/test_xml_files/multiple_simple_docs.xml"
+
+    collectionTransformer = XmlCollectionToTabular(
+        xml_path,
+        simple_config,
+        ":memory:",
+        "sqlite",
+        processes=1,
+        batch_size=2,
+    )
+
+    db = collectionTransformer.convert()
+
+    assert db.execute("SELECT name FROM album;").fetchall() == [
+        ("Five Leaves Left",),
+        ("Bryter Layter",),
+        ("Pink Moon",),
+    ]
+
+
+@pytest.mark.parametrize("doc_index", [False, True])
+def test_small_files_spread_across_workers(simple_config, doc_index):
+
+    # a file of many small documents, well under BATCH_BYTES
+    docs = Path("tests/test_xml_files/multiple_simple_docs.xml").read_bytes()
+    xml_path = Path(tempfile.mkdtemp()) / "docs.xml"
+    xml_path.write_bytes(docs * 300)
+    assert xml_path.stat().st_size < 1 << 20
+
+    collectionTransformer = XmlCollectionToTabular(
+        str(xml_path),
+        simple_config,
+        ":memory:",
+        "sqlite",
+        processes=4,
+        doc_index=doc_index,
+        index_dir=tempfile.mkdtemp(),
+    )
+
+    tasks = list(collectionTransformer.yield_tasks(xml_path))
+    assert len(tasks) >= 4
+
+
+def test_streaming_writes_to_csv(simple_config):
+
+    xml_path = "tests/test_xml_files/multiple_simple_docs.xml"
+    output_path = Path(tempfile.mkdtemp())
+
+    collectionTransformer = XmlCollectionToTabular(
+        xml_path,
+        simple_config,
+        output_path,
+        "csv",
+        processes=1,
+        batch_size=1,
+        flush_rows=1,
+        max_in_flight=1,
+    )
+    collectionTransformer.convert()
+
+    with (output_path / "album.csv").open() as _fh:
+        assert [row["name"] for row in csv.DictReader(_fh)] == [
+            "Five Leaves Left",
+            "Bryter Layter",
+            "Pink Moon",
+        ]
+
+
+def test_streaming_records_from_a_single_document(simple_config):
+
+    xml_path = Path(tempfile.mkdtemp()) / "albums.xml"
+    xml_path.write_text(
+        """\
+<?xml version="1.0" encoding="UTF-8"?>
+<albums xmlns="http://example.com/albums">
+  <album><name>Five Leaves Left</name><released>1969</released></album>
+  <album><name>Bryter Layter</name><released>1971</released></album>
+  <album><name>Pink Moon</name><released>1972</released></album>
+</albums>
+"""
+    )
+
+    collectionTransformer = XmlCollectionToTabular(
+        str(xml_path),
+        {"<record_element>": "album", **simple_config},
+        ":memory:",
+        "sqlite",
+        processes=1,
+    )
+
+    db = collectionTransformer.convert()
+
+    assert db.execute("SELECT name, released FROM album;").fetchall() == [
+        ("Five Leaves Left", "1969"),
+        ("Bryter Layter", "1971"),
+        ("Pink Moon", "1972"),
+    ]
+
+
+@pytest.mark.parametrize("archive_name", ("albums.zip", "albums.tar.gz"))
+def test_documents_in_archives(archive_name):
+
+    config = {
+        "album": {
+            "<entity>": "album",
+            "<filename_field>": "source",
+            "<fields>": {"name": "name"},
+        }
+    }
+    members = {
+        "multiple/docs.xml": Path("tests/test_xml_files/multiple_simple_docs.xml"),
+        "single/doc.xml": Path("tests/test_xml_files/one_doc_per_file/drake_001.xml"),
+    }
+
+    archive_path = Path(tempfile.mkdtemp()) / archive_name
+    if archive_name.endswith(".zip"):
+        with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, path in members.items():
+                archive.write(path, name)
+    else:
+        with tarfile.open(archive_path, "w:gz") as archive:
+            for name, path in members.items():
+                archive.add(path, name)
+
+    collectionTransformer = XmlCollectionToTabular(
+        str(archive_path.parent), config, ":memory:", "sqlite", processes=1
+    )
+
+    db = collectionTransformer.convert()
+
+    assert db.execute("SELECT name, source FROM album;").fetchall() == [
+        ("Five Leaves Left", "multiple/docs.xml"),
+        ("Bryter Layter", "multiple/docs.xml"),
+        ("Pink Moon", "multiple/docs.xml"),
+        ("Five Leaves Left", "single/doc.xml"),
+    ]
+
+
+def test_interleaved_files_largest_first(simple_config):
+
+    collectionTransformer = XmlCollectionToTabular(
+        [
+            "tests/test_xml_files/one_doc_per_file/drake_003.xml",
+            "tests/test_xml_files/multiple_simple_docs.xml",
+        ],
+        simple_config,
+        ":memory:",
+        "sqlite",
+        processes=2,
+        batch_size=1,
+        interleave_files=True,
+    )
+
+    db = collectionTransformer.convert()
+
+    assert db.execute("SELECT name FROM album;").fetchall() == [
+        ("Five Leaves Left",),
+        ("Bryter Layter",),
+        ("Pink Moon",),
+        ("Pink Moon",),
+    ]
+
+
+def test_documents_with_wrong_doctype_filtered_before_dispatch(simple_config):
+
+    xml_path = Path(tempfile.mkdtemp()) / "albums.xml"
+    xml_path.write_text(
+        """\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE album SYSTEM "album.dtd">
+<album><name>Five Leaves Left</name></album>
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE single SYSTEM "single.dtd">
+<single><name>River Man</name></single>
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE album SYSTEM "album.dtd">
+<album><name>Pink Moon</name></album>
+"""
+    )
+
+    collectionTransformer = XmlCollectionToTabular(
+        [xml_path],
+        {"<root_element>": "album", **simple_config},
+        ":memory:",
+        "sqlite",
+        processes=1,
+        check_doctype=True,
+        continue_on_error=True,
+    )
+
+    dispatched = [
+        payload["doc"]
+        for _, batch in collectionTransformer.yield_tasks(xml_path)
+        for payload in batch
+    ]
+    assert len(dispatched) == 2
+    assert not any(b"<single>" in doc for doc in dispatched)
+
+    db = collectionTransformer.convert()
+    assert db.execute("SELECT name FROM album;").fetchall() == [
+        ("Five Leaves Left",),
+        ("Pink Moon",),
+    ]
+
+
+def test_documents_filtered_before_dispatch(simple_config):
+
+    xml_path = "tests/test_xml_files/multiple_simple_docs.xml"
+
+    collectionTransformer = XmlCollectionToTabular(
+        xml_path,
+        {"<filter>": {"<literal>": ["Bryter", "Pink"]}, **simple_config},
+        ":memory:",
+        "sqlite",
+        processes=1,
+    )
+
+    dispatched = [
+        payload
+        for _, batch in collectionTransformer.yield_tasks(Path(xml_path))
+        for payload in batch
+    ]
+    assert len(dispatched) == 2
+    assert all(payload["checked"] for payload in dispatched)
+
+    db = collectionTransformer.convert()
+    assert db.execute("SELECT name FROM album;").fetchall() == [
+        ("Bryter Layter",),
+        ("Pink Moon",),
+    ]
+
+
+def test_documents_skipped_by_workers_reported(simple_config, caplog):
+
+    xml_path = Path(tempfile.mkdtemp()) / "albums.xml"
+    xml_path.write_bytes(
+        Path("tests/test_xml_files/multiple_simple_docs.xml").read_bytes()
+    )
+
+    collectionTransformer = XmlCollectionToTabular(
+        str(xml_path),
+        {"<filter>": {"<literal>": ["Bryter", "Pink"]}, **simple_config},
+        ":memory:",
+        "sqlite",
+        processes=1,
+        doc_index=True,
+    )
+    # documents are read (and so checked) by the workers themselves
+    assert {
+        func.__name__ for func, _ in collectionTransformer.yield_tasks(xml_path)
+    } == {"process_doc_range_in_worker"}
+
+    with caplog.at_level(logging.WARNING):
+        db = collectionTransformer.convert()
+    assert db.execute("SELECT name FROM album;").fetchall() == [
+        ("Bryter Layter",),
+        ("Pink Moon",),
+    ]
+    assert "1 documents skipped by <filter>" in caplog.messages
+
+
+def test_documents_skipped_in_gzip_ranges_counted(simple_config):
+
+    # one gzip member per document, so that the documents are split by workers
+    gz_path = Path(tempfile.mkdtemp()) / "albums.xml.gz"
+    docs = Path("tests/test_xml_files/multiple_simple_docs.xml").read_bytes()
+    gz_path.write_bytes(
+        b"".join(gzip.compress(b"<?xml" + doc) for doc in docs.split(b"<?xml")[1:])
+    )
+
+    init_worker(
+        XmlCollectionToTabular(
+            [],
+            {"<filter>": {"<literal>": "Pink"}, **simple_config},
+            ":memory:",
+            "sqlite",
+        ).get_doc_parser_kwargs()
+    )
+    results = [
+        process_gzip_range_in_worker(gzip_range)
+        for gzip_range in yield_gzip_ranges(gz_path, range_bytes=1)
+    ]
+
+    assert [num_docs for num_docs, _, _, _ in results] == [0, 0, 1]
+    assert [num_skipped for _, _, _, num_skipped in results] == [(1, 0), (1, 0), (0, 0)]
+
+
+@pytest.mark.parametrize("output_type", ["sqlite", "csv"])
+def test_worker_output_merged(simple_config, output_type):
+
+    xml_path = "tests/test_xml_files/multiple_simple_docs.xml"
+    output_path = Path(tempfile.mkdtemp())
+
+    collectionTransformer = XmlCollectionToTabular(
+        xml_path,
+        simple_config,
+        output_path,
+        output_type,
+        processes=2,
+        batch_size=1,
+        worker_output=True,
+    )
+    collectionTransformer.convert()
+
+    if output_type == "sqlite":
+        names = sqlite3.connect(output_path / "db.sqlite").execute(
+            "SELECT name FROM album;"
+        )
+    else:
+        with (output_path / "album.csv").open() as _fh:
+            names = [(row["name"],) for row in csv.DictReader(_fh)]
+
+    # rows are merged worker by worker, so aren't necessarily in document order
+    assert sorted(names) == [("Bryter Layter",), ("Five Leaves Left",), ("Pink Moon",)]
+    # parts are removed once merged
+    assert [path.name for path in output_path.iterdir()] == [
+        "db.sqlite" if output_type == "sqlite" else "album.csv"
+    ]
+
+
+def test_worker_output_merged_into_memory_db(simple_config):
+
+    collectionTransformer = XmlCollectionToTabular(
+        "tests/test_xml_files/multiple_simple_docs.xml",
+        simple_config,
+        ":memory:",
+        "sqlite",
+        processes=2,
+        batch_size=1,
+        worker_output=True,
+    )
+    db = collectionTransformer.convert()
+
+    assert sorted(db.execute("SELECT name FROM album;")) == [
+        ("Bryter Layter",),
+        ("Five Leaves Left",),
+        ("Pink Moon",),
+    ]
+
+
+@pytest.mark.parametrize("output_type", ["sqlite", "csv"])
+def test_write_tables_with_rows_as_dicts(simple_config, output_type):
+
+    output_path = Path(tempfile.mkdtemp())
+    collectionTransformer = XmlCollectionToTabular(
+        [], simple_config, output_path, output_type
+    )
+    collectionTransformer.write_tables(
+        {
+            "album": [
+                {"name": "Pink Moon", "artist": "Nick Drake"},
+                ("Bryter Layter", "Nick Drake", "1970", "Island", "Folk"),
+            ]
+        }
+    )
+
+    if output_type == "sqlite":
+        collectionTransformer.db.close()
+        rows = sqlite3.connect(output_path / "db.sqlite").execute(
+            "SELECT name, artist, released FROM album;"
+        )
+    else:
+        with (output_path / "album.csv").open() as _fh:
+            rows = [
+                (row["name"], row["artist"], row["released"] or None)
+                for row in csv.DictReader(_fh)
+            ]
+
+    # dicts are bound by name, with missing fields left empty
+    assert list(rows) == [
+        ("Pink Moon", "Nick Drake", None),
+        ("Bryter Layter", "Nick Drake", "1970"),
+    ]
+
+
+def test_convert_called_again(simple_config):
+
+    output_path = Path(tempfile.mkdtemp())
+
+    collectionTransformer = XmlCollectionToTabular(
+        "tests/test_xml_files/multiple_simple_docs.xml",
+        simple_config,
+        output_path,
+        "sqlite",
+        processes=1,
+    )
+    collectionTransformer.convert()
+    # the database, closed at the end of the first run, is reopened and appended to
+    collectionTransformer.convert()
+
+    assert sqlite3.connect(output_path / "db.sqlite").execute(
+        "SELECT count(*) FROM album;"
+    ).fetchone() == (6,)
+
+
+@pytest.mark.parametrize("output_type", ["sqlite", "csv"])
+def test_part_writes_logged_at_debug_level(simple_config, output_type, caplog):
+
+    partWriter = PartWriter(
+        tempfile.mkdtemp(), output_type, simple_config, logging.getLogger("test")
+    )
+    row = ("Pink Moon", "Nick Drake", "1972", "Island", "Folk")
+
+    with caplog.at_level(logging.INFO):
+        assert partWriter.write_tables({"album": [row]}) == 1
+    # (a worker writes once per task, so only the merge is reported)
+    assert not caplog.records
+
+    with caplog.at_level(logging.DEBUG):
+        partWriter.write_tables({"album": [row]})
+    assert caplog.records and {record.levelno for record in caplog.records} == {
+        logging.DEBUG
+    }
+
+
+def test_write_errors_raised_from_background_writer(simple_config):
+
+    # a primary key that isn't unique can't be written to the database
+    simple_config["album"]["<primary_key>"] = "label"
+
+    collectionTransformer = XmlCollectionToTabular(
+        "tests/test_xml_files/multiple_simple_docs.xml",
+        simple_config,
+        ":memory:",
+        "sqlite",
+        processes=1,
+        batch_size=1,
+        flush_rows=1,
+    )
+    with pytest.raises(sqlite3.IntegrityError):
+        collectionTransformer.convert()
+
+
+def test_stream_engine(simple_config):
+
+    collectionTransformer = XmlCollectionToTabular(
+        "tests/test_xml_files/multiple_simple_docs.xml",
+        simple_config,
+        ":memory:",
+        "sqlite",
+        processes=1,
+        engine="stream",
+    )
+    db = collectionTransformer.convert()
+
+    assert db.execute("SELECT name FROM album;").fetchall() == [
+        ("Five Leaves Left",),
+        ("Bryter Layter",),
+        ("Pink Moon",),
+    ]
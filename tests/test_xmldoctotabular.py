@@ -1,6 +1,12 @@
+import re
+from pathlib import Path
+
+import pytest
 import yaml
+from lxml import etree
 
 from xmltotabular import XmlDocToTabular
+from xmltotabular.utils import get_fieldnames_from_config
 
 
 def test_single_simple_entity_per_doc(simple_config):
@@ -283,3 +289,225 @@ def test_namespace_resolution_with_no_default():
             }
         ]
     }
+
+
+def test_doc_as_bytes_in_declared_encoding(simple_config):
+    xml = """\
+<?xml version="1.0" encoding="ISO-8859-1"?>
+<album>
+  <name>Élan</name>
+  <artist>Nick Drake</artist>
+  <released>1969</released>
+  <label>Island</label>
+  <genre>Folk</genre>
+</album>
+    """.encode(
+        "iso-8859-1"
+    )
+
+    docTransformer = XmlDocToTabular(simple_config)
+
+    assert docTransformer.process_doc(xml)["album"][0]["name"] == "Élan"
+
+
+def test_preprocess_bytes(simple_config):
+    xml = b"""\
+<?xml version="1.0" encoding="UTF-8"?>
+<album>
+  <name>Five Leaves Left</name>
+  <artist>Nick Drake</artist>
+  <released>1969</released>
+  <label>Island</label>
+  <genre>Folk</genre>
+</album>
+    """
+
+    docTransformer = XmlDocToTabular(
+        simple_config, preprocess_bytes=lambda doc: doc.replace(b"Folk", b"Folk Rock")
+    )
+
+    assert docTransformer.process_doc(xml)["album"][0]["genre"] == "Folk Rock"
+
+
+def test_process_doc_from_pool_discards_previous_results(simple_config):
+    docTransformer = XmlDocToTabular(simple_config)
+
+    for name in ("Five Leaves Left", "Bryter Layter"):
+        xml = f"<?xml version='1.0'?><album><name>{name}</name></album>".encode()
+        assert docTransformer.process_doc_from_pool({"doc": xml}) == {
+            "album": [{"id": "None_0", "name": name}]
+        }
+
+
+def test_dtds_are_cached_and_validated(simple_config):
+    xml = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE album SYSTEM "album.dtd" [ ]>
+<album>
+  <name>{name}</name>
+  <artist>Nick Drake</artist>
+  <label>&island;</label>{extra}
+</album>
+    """
+
+    docTransformer = XmlDocToTabular(
+        simple_config, dtd_path="tests/test_xml_files/dtd", validate=True
+    )
+
+    for name in ("Five Leaves Left", "Bryter Layter"):
+        tables = docTransformer.process_doc_from_pool(
+            {"doc": xml.format(name=name, extra="").encode()}
+        )
+        assert tables["album"][0]["label"] == "Island Records"
+
+    assert sorted(Path(path).name for path in docTransformer.resolver.cache) == [
+        "album.dtd",
+        "labels.ent",
+    ]
+
+    with pytest.raises(SystemExit):
+        docTransformer.process_doc_from_pool(
+            {"doc": xml.format(name="Pink Moon", extra="<genre>Folk</genre>").encode()}
+        )
+
+
+def test_internal_dtd_subsets_are_validated(simple_config):
+    xml = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE album SYSTEM "album.dtd" [ <!ATTLIST album year CDATA #IMPLIED> ]>
+<album {attribute}>
+  <name>Pink Moon</name>
+  <artist>Nick Drake</artist>
+  <label>&island;</label>
+</album>
+    """
+
+    docTransformer = XmlDocToTabular(
+        simple_config, dtd_path="tests/test_xml_files/dtd", validate=True
+    )
+
+    # the internal subset adds to the external DTD
+    for _ in range(2):
+        tables = docTransformer.process_doc_from_pool(
+            {"doc": xml.format(attribute='year="1972"').encode()}
+        )
+        assert tables["album"][0]["name"] == "Pink Moon"
+
+    with pytest.raises(SystemExit):
+        docTransformer.process_doc_from_pool(
+            {"doc": xml.format(attribute='month="February"').encode()}
+        )
+
+
+def test_filtered_doc_not_parsed(simple_config):
+    docTransformer = XmlDocToTabular(
+        {"<filter>": {"<literal>": "Pink Moon"}, **simple_config}
+    )
+
+    # would raise, were it parsed
+    assert docTransformer.process_doc(b"<album><name>Nick Drake</album>") == {}
+    assert docTransformer.process_doc(b"<album><name>Pink Moon</name></album>") == {
+        "album": [{"id": "None_0", "name": "Pink Moon"}]
+    }
+
+
+def test_factored_paths_match_xpath():
+    config = {
+        "album": {
+            "<entity>": "album",
+            "<fields>": {
+                "details/name": "name",
+                "details/artist": {"<fieldname>": "artists", "<joiner>": ", "},
+                "details/@format": "format",
+                "details/credit/@role": {"<fieldname>": "roles", "<joiner>": ", "},
+                "details/credit": {"<fieldname>": "credits", "<joiner>": ", "},
+            },
+        }
+    }
+    xml = """\
+<album xmlns="http://example.com/albums">
+  <details format="LP"><name>Bryter Layter</name><artist>Nick Drake</artist></details>
+  <details><artist>John Cale</artist><!-- comment -->
+    <credit role="viola">John Cale</credit><credit>Richard Thompson</credit></details>
+</album>"""
+
+    docTransformer = XmlDocToTabular(config)
+    tables = docTransformer.process_doc(xml)
+
+    assert [
+        path_plan.factored is not None
+        for path_plan in docTransformer.current_plan.paths[0].action.fields
+    ] == [True, True, True, False, True]
+    assert tables == {
+        "album": [
+            {
+                "id": "None_0",
+                "name": "Bryter Layter",
+                "artists": "Nick Drake, John Cale",
+                "format": "LP",
+                "roles": "viola",
+                "credits": "John Cale, Richard Thompson",
+            }
+        ]
+    }
+
+
+def test_get_text_matches_serialized_text():
+    tree = etree.fromstring(
+        '<album id=" ILPS  9105 ">'
+        "<name>\n  Five\xa0Leaves   Left </name> after name\n"
+        "<genre>Folk <!-- baroque? --> and<?pi x?> <b>Baroque</b> pop"
+        "<![CDATA[ (Island) ]]></genre><!-- comment --> after comment"
+        "<label/><released> 1969 </released>"
+        "</album>"
+    )
+
+    def serialized_text(result):
+        if isinstance(result, str):
+            return re.sub(r"\s+", " ", result).strip()
+        return re.sub(
+            r"\s+", " ", etree.tostring(result, method="text", encoding="unicode")
+        ).strip()
+
+    results = tree.xpath("//node() | //@*") + tree.xpath("//text()") + ["   x\t"]
+    assert len(results) > 20
+    for result in results:
+        assert XmlDocToTabular.get_text(result) == serialized_text(result)
+
+
+def test_tuple_rows_follow_the_fieldnames_of_their_tables():
+    config = yaml.safe_load(
+        """
+        album:
+          <entity>: album
+          <primary_key>: "@id"
+          <fields>:
+            name: name
+            genre: genre
+            tracks/track:
+              <entity>: track
+              <fields>:
+                title: title
+                "@n": number
+        """
+    )
+    xml = """\
+<album id="ILPS 9105">
+  <name>Five Leaves Left</name>
+  <tracks>
+    <track n="1"><title>Time Has Told Me</title></track>
+    <track n="2"><title>River Man</title></track>
+  </tracks>
+</album>
+    """
+
+    records = XmlDocToTabular(config).process_doc(xml)
+    rows = XmlDocToTabular(config, tuple_rows=True).process_doc(xml)
+
+    fieldnames = get_fieldnames_from_config(config)
+    assert fieldnames["track"] == ["id", "album_id", "title", "number"]
+    assert rows == {
+        tablename: [tuple(map(record.get, fieldnames[tablename])) for record in records]
+        for tablename, records in records.items()
+    }
+    assert rows["album"] == [("ILPS 9105", "Five Leaves Left", None)]
@@ -0,0 +1,80 @@
+import hashlib
+import mmap
+from collections import namedtuple
+from operator import attrgetter
+from pathlib import Path
+
+from .utils import (
+    BATCH_BYTES,
+    batch_payloads,
+    get_index_path,
+    iter_xml_docs,
+    read_index,
+    read_xml_doc,
+    write_index,
+)
+
+
+# `offset` and `length` locate the document in the file, `linenum` is the (zero-indexed)
+#  line on which it starts, and `digest` is a hash of its content.
+DocEntry = namedtuple("DocEntry", ("offset", "length", "linenum", "digest"))
+
+# A range of documents from an (uncompressed) file, to be read by a worker.
+DocRange = namedtuple("DocRange", ("path", "entries"))
+
+
+def get_digest(doc):
+    return hashlib.blake2b(doc, digest_size=16).hexdigest()
+
+
+def build_doc_index(filepath):
+    return [
+        DocEntry(start, end - start, linenum, get_digest(doc))
+        for start, end, linenum, doc in iter_xml_docs(filepath)
+    ]
+
+
+def load_doc_index(filepath, cache_dir=None):
+    """Return a DocEntry for each document in `filepath`, from a sidecar index if
+    there's a valid one, or else by scanning the file (and writing a sidecar index for
+    next time).  For compressed files, offsets are into the decompressed content."""
+    index_path = get_index_path(filepath, ".docidx", cache_dir)
+    index = read_index(index_path, filepath)
+    if index is not None:
+        return [DocEntry(*entry) for entry in index["docs"]]
+
+    entries = build_doc_index(filepath)
+    write_index(index_path, filepath, docs=entries)
+    return entries
+
+
+def read_indexed_doc(filepath, doc_number, cache_dir=None):
+    """Return the `doc_number`th (zero-indexed) document in `filepath`."""
+    entry = load_doc_index(filepath, cache_dir)[doc_number]
+    return read_xml_doc(filepath, entry.offset, entry.offset + entry.length)
+
+
+def yield_doc_ranges(filepath, entries, batch_size=None, batch_bytes=BATCH_BYTES):
+    """Group index entries into DocRanges, sized as batch_payloads() sizes batches."""
+    path = str(Path(filepath).resolve())
+    for batch in batch_payloads(
+        entries, batch_size, batch_bytes, get_size=attrgetter("length")
+    ):
+        yield DocRange(path, tuple(batch))
+
+
+def read_doc_range(doc_range):
+    """Return payloads (as yield_xml_doc() yields them) for the documents in a
+    DocRange of an uncompressed file."""
+    filename = Path(doc_range.path).name
+    with open(doc_range.path, "rb") as _fh, mmap.mmap(
+        _fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        return [
+            {
+                "filename": filename,
+                "linenum": entry.linenum,
+                "doc": buffer[entry.offset : entry.offset + entry.length],
+            }
+            for entry in doc_range.entries
+        ]
@@ -0,0 +1,218 @@
+import struct
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+from .utils import (
+    XML_DECLARATION,
+    LEADING_WHITESPACE,
+    scan_buffer,
+    sniff_compression,
+    get_index_path,
+    read_index,
+    write_index,
+)
+
+
+# Ranges of members dispatched to workers are made up of at least this many bytes of
+#  decompressed data.
+RANGE_BYTES = 16 << 20
+
+COMPRESSED_CHUNK_SIZE = 256 << 10
+
+# `offset` is the offset of the member in the compressed file, `decompressed_offset`
+#  the offset of its content in the decompressed data, and `linenum` the number of
+#  lines which precede it (or None, if the index was built without decompressing).
+GzipMember = namedtuple("GzipMember", ("offset", "decompressed_offset", "linenum"))
+
+# A range of members to be decompressed and split into documents independently of the
+#  rest of the file; `start` and `end` are offsets into the decompressed data, and a
+#  document belongs to the range in which its declaration starts.
+GzipRange = namedtuple(
+    "GzipRange", ("path", "offset", "start", "end", "linenum", "is_first")
+)
+
+
+def is_gzip(filepath):
+    return sniff_compression(filepath) == "gzip"
+
+
+def walk_bgzf_members(filepath):
+    """Return the members of a BGZF file (as written by `bgzip`, for example), whose
+    headers record the compressed size of each member and whose trailers record the
+    decompressed size, so that the file can be indexed without decompressing it.
+    Returns None if the file isn't BGZF."""
+    members = []
+    offset = decompressed_offset = 0
+
+    with open(filepath, "rb") as _fh:
+        while True:
+            header = _fh.read(18)
+            if not header:
+                break
+            # magic bytes, deflate, FEXTRA flag, 6-byte "BC" subfield
+            if (
+                len(header) < 18
+                or header[:4] != b"\x1f\x8b\x08\x04"
+                or header[12:14] != b"BC"
+            ):
+                return None
+            block_size = struct.unpack("<H", header[16:18])[0] + 1
+            _fh.seek(offset + block_size - 4)
+            decompressed_size = struct.unpack("<I", _fh.read(4))[0]
+            if decompressed_size:
+                members.append(GzipMember(offset, decompressed_offset, None))
+            offset += block_size
+            decompressed_offset += decompressed_size
+            _fh.seek(offset)
+
+    return members, decompressed_offset
+
+
+def scan_gzip_members(filepath):
+    """Return the members of a gzip file, and the length of its decompressed data, by
+    decompressing it (once)."""
+    members = []
+    offset = decompressed_offset = linenum = 0
+    decompressor = None
+    pending = b""
+
+    with open(filepath, "rb") as _fh:
+        while True:
+            if not pending:
+                pending = _fh.read(COMPRESSED_CHUNK_SIZE)
+                if not pending:
+                    break
+            if decompressor is None:
+                if not pending.strip(b"\x00"):
+                    # trailing padding, as tolerated by the gzip module
+                    offset += len(pending)
+                    pending = b""
+                    continue
+                members.append(GzipMember(offset, decompressed_offset, linenum))
+                decompressor = zlib.decompressobj(wbits=31)
+
+            data = decompressor.decompress(pending)
+            decompressed_offset += len(data)
+            linenum += data.count(b"\n")
+
+            if decompressor.eof:
+                offset += len(pending) - len(decompressor.unused_data)
+                pending = decompressor.unused_data
+                decompressor = None
+            else:
+                offset += len(pending)
+                pending = b""
+
+    return members, decompressed_offset
+
+
+def load_gzip_index(filepath, cache_dir=None):
+    """Return the members of a gzip file and the length of its decompressed data, from
+    a sidecar index if there's a valid one, or else by indexing the file (and writing a
+    sidecar index for next time)."""
+    index_path = get_index_path(filepath, ".gzidx", cache_dir)
+    index = read_index(index_path, filepath)
+    if index is not None:
+        return [GzipMember(*member) for member in index["members"]], index["length"]
+
+    members, length = walk_bgzf_members(filepath) or scan_gzip_members(filepath)
+    write_index(index_path, filepath, members=members, length=length)
+    return members, length
+
+
+def yield_gzip_ranges(filepath, range_bytes=RANGE_BYTES, cache_dir=None):
+    """Group the members of a gzip file into GzipRanges of at least `range_bytes` of
+    decompressed data, which can be decompressed and split in parallel."""
+    members, length = load_gzip_index(filepath, cache_dir)
+
+    first = None
+    for member in members:
+        if first is None:
+            first = member
+        elif member.decompressed_offset - first.decompressed_offset >= range_bytes:
+            yield GzipRange(
+                str(Path(filepath).resolve()),
+                first.offset,
+                first.decompressed_offset,
+                member.decompressed_offset,
+                first.linenum,
+                first.decompressed_offset == 0,
+            )
+            first = member
+
+    if first is not None:
+        yield GzipRange(
+            str(Path(filepath).resolve()),
+            first.offset,
+            first.decompressed_offset,
+            length,
+            first.linenum,
+            first.decompressed_offset == 0,
+        )
+
+
+def iter_gzip_data(filepath, offset):
+    """Yield chunks of decompressed data from the gzip member at `offset` onwards."""
+    decompressor = None
+    pending = b""
+
+    with open(filepath, "rb") as _fh:
+        _fh.seek(offset)
+        while True:
+            if not pending:
+                pending = _fh.read(COMPRESSED_CHUNK_SIZE)
+                if not pending:
+                    return
+            if decompressor is None:
+                if not pending.strip(b"\x00"):
+                    pending = b""
+                    continue
+                decompressor = zlib.decompressobj(wbits=31)
+
+            yield decompressor.decompress(pending)
+
+            if decompressor.eof:
+                pending = decompressor.unused_data
+                decompressor = None
+            else:
+                pending = b""
+
+
+def split_gzip_range(gzip_range):
+    """Decompress a GzipRange and yield a `(start, end, linenum, doc)` tuple (as
+    iter_xml_docs() does) for each document which belongs to it.  Decompression
+    continues past the end of the range as far as necessary to complete the last
+    document.  Line numbers are None if the index doesn't record them."""
+    length = gzip_range.end - gzip_range.start
+    buffer = bytearray()
+    cut = -1
+
+    for data in iter_gzip_data(gzip_range.path, gzip_range.offset):
+        buffer += data
+        if len(buffer) > length:
+            cut = buffer.find(XML_DECLARATION, length)
+            if cut != -1:
+                break
+    if cut == -1:
+        cut = len(buffer)
+
+    if gzip_range.is_first:
+        begin = LEADING_WHITESPACE.match(buffer).end()
+    else:
+        begin = buffer.find(XML_DECLARATION, 0, max(length, 0) + len(XML_DECLARATION))
+        if begin == -1 or begin >= length:
+            # no document starts in this range
+            return
+    linenum = gzip_range.linenum
+    if linenum is not None:
+        linenum += buffer.count(b"\n", 0, begin)
+
+    view = bytes(buffer[begin:cut])
+    for start, end, doc_linenum, doc in scan_buffer(view):
+        yield (
+            gzip_range.start + begin + start,
+            gzip_range.start + begin + end,
+            None if linenum is None else linenum + doc_linenum,
+            doc,
+        )
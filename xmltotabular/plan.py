@@ -0,0 +1,198 @@
+import re
+from collections import Counter, namedtuple
+
+from lxml import etree
+
+from .utils import get_fieldnames_from_config
+
+
+# Kinds of action which may be applied to the results of an XPath expression, decided
+#  in advance from the form of the config for that expression.
+FIELD, JOINER, ENUM_MAP, ENUM_TYPE, ENTITY, MULTIPLE, INVALID = range(7)
+
+
+# `path` is the XPath expression with namespaces resolved, and `xpath` the compiled
+#  expression; `warn_on_multiple` is set if the config for this path can't account for
+#  multiple results.  `factored` is a FactoredPath if the path shares its parent with
+#  other paths from the same context, or else None.
+PathPlan = namedtuple(
+    "PathPlan", ("path", "xpath", "action", "warn_on_multiple", "factored")
+)
+
+# A simple path split into its parent `prefix` (and the compiled expression for it),
+#  which is evaluated once per context for all the paths that share it, and its last
+#  step, `leaf` -- an element tag or attribute name in Clark notation -- which is looked
+#  up on the elements the prefix finds.
+FactoredPath = namedtuple(
+    "FactoredPath", ("prefix", "prefix_xpath", "leaf", "is_attribute")
+)
+
+# `value` is the joiner, enum map or enum type, according to `kind`.
+FieldAction = namedtuple("FieldAction", ("kind", "fieldname", "value"))
+
+# `primary_key` is a tuple of (expression, compiled expression) pairs, the text of
+#  whose results are joined with "-" to form the key, and `fields` a tuple of PathPlans.
+EntityAction = namedtuple(
+    "EntityAction", ("kind", "entity", "primary_key", "filename_field", "fields")
+)
+
+MultipleAction = namedtuple("MultipleAction", ("kind", "actions"))
+
+InvalidAction = namedtuple("InvalidAction", ("kind", "config"))
+
+# `prefixed_tags` caches element tags (in Clark notation) converted to prefixed names.
+ExtractionPlan = namedtuple(
+    "ExtractionPlan", ("paths", "fieldnames", "ns_map", "prefixed_tags")
+)
+
+
+# Paths made up only of element names (optionally prefixed), with an optional attribute
+#  at the end -- "a/b", "p:a/b/@id", "@id" -- are "simple paths", which can be evaluated
+#  without XPath.
+SIMPLE_NAME = re.compile(r"(?:[A-Za-z_][\w.-]*:)?[A-Za-z_][\w.-]*")
+
+
+class NotSimplePath(ValueError):
+    pass
+
+
+def split_simple_path(path):
+    """Return the element steps and the attribute (or None) of a simple path, or raise
+    NotSimplePath."""
+    steps = path.split("/")
+    attr = steps.pop()[1:] if steps[-1].startswith("@") else None
+    if attr is not None and not SIMPLE_NAME.fullmatch(attr):
+        raise NotSimplePath(path)
+    if not all(SIMPLE_NAME.fullmatch(step) for step in steps):
+        raise NotSimplePath(path)
+    return steps, attr
+
+
+def to_clark(name, ns_map):
+    """Return a (possibly prefixed) name in Clark notation, or raise NotSimplePath if
+    its prefix is unknown (in which case XPath would fail to evaluate it)."""
+    if ":" not in name:
+        return name
+    prefix, local_name = name.split(":", 1)
+    if prefix not in ns_map:
+        raise NotSimplePath(name)
+    return f"{{{ns_map[prefix]}}}{local_name}"
+
+
+def resolve_namespaces_in_xpath(expression, ns_map):
+    """Prefix unqualified element names in `expression` with "_:" if the document has
+    a default namespace (which XPath can't otherwise address)."""
+    if "_" in ns_map:
+        expression = "/".join(
+            f"_:{_}" if ":" not in _ and _[0] not in "@[" else _
+            for _ in expression.split("/")
+        )
+
+    return expression
+
+
+def factor_paths(path_plans, ns_map, compile_xpath):
+    """Set `factored` for those of `path_plans` (from the same context) which are simple
+    paths sharing their parent with at least one other."""
+    split_paths = {}
+    for path_plan in path_plans:
+        try:
+            steps, attr = split_simple_path(path_plan.path)
+            leaf = to_clark(attr, ns_map) if attr else to_clark(steps.pop(), ns_map)
+        except NotSimplePath:
+            continue
+        if steps:
+            split_paths[path_plan.path] = ("/".join(steps), leaf, attr is not None)
+
+    num_children = Counter(prefix for prefix, _, _ in split_paths.values())
+
+    factored_paths = []
+    for path_plan in path_plans:
+        if path_plan.path in split_paths:
+            prefix, leaf, is_attribute = split_paths[path_plan.path]
+            if num_children[prefix] > 1:
+                path_plan = path_plan._replace(
+                    factored=FactoredPath(
+                        prefix, compile_xpath(prefix)[1], leaf, is_attribute
+                    )
+                )
+        factored_paths.append(path_plan)
+    return tuple(factored_paths)
+
+
+def compile_plan(config, ns_map):
+    """Compile `config` into an ExtractionPlan for documents with namespaces `ns_map`,
+    so that XPath expressions are resolved and compiled, and the handling of their
+    results is decided, once rather than for every element of every document."""
+
+    xpaths = {}
+
+    def compile_xpath(expression):
+        expression = resolve_namespaces_in_xpath(expression, ns_map)
+        if expression not in xpaths:
+            xpaths[expression] = etree.XPath(expression, namespaces=ns_map)
+        return expression, xpaths[expression]
+
+    def compile_path(path, config):
+        path, xpath = compile_xpath(path)
+        warn_on_multiple = not any(
+            key in config
+            for key in ("<entity>", "<joiner>", "<enum_map>", "<enum_type>")
+        )
+        return PathPlan(path, xpath, compile_action(config), warn_on_multiple, None)
+
+    def compile_action(config):
+        if isinstance(config, str):
+            return FieldAction(FIELD, config, None)
+
+        if isinstance(config, list):
+            return MultipleAction(MULTIPLE, tuple(map(compile_action, config)))
+
+        if "<entity>" in config:
+            primary_key = config.get("<primary_key>")
+            if isinstance(primary_key, str):
+                primary_key = [primary_key]
+            return EntityAction(
+                ENTITY,
+                config["<entity>"],
+                tuple(map(compile_xpath, primary_key)) if primary_key else None,
+                config.get("<filename_field>"),
+                factor_paths(
+                    [
+                        compile_path(subpath, subconfig)
+                        for subpath, subconfig in config["<fields>"].items()
+                    ],
+                    ns_map,
+                    compile_xpath,
+                ),
+            )
+
+        if "<fieldname>" in config:
+            for key, kind in (
+                ("<joiner>", JOINER),
+                ("<enum_map>", ENUM_MAP),
+                ("<enum_type>", ENUM_TYPE),
+            ):
+                if key in config:
+                    return FieldAction(kind, config["<fieldname>"], config[key])
+
+            # just an explicit mapping to a fieldname string
+            if len(config) == 1:
+                return FieldAction(FIELD, config["<fieldname>"], None)
+
+        return InvalidAction(INVALID, config)
+
+    return ExtractionPlan(
+        factor_paths(
+            [
+                compile_path(path, subconfig)
+                for path, subconfig in config.items()
+                if not path.startswith("<")
+            ],
+            ns_map,
+            compile_xpath,
+        ),
+        get_fieldnames_from_config(config),
+        ns_map,
+        {},
+    )
@@ -0,0 +1,137 @@
+import csv
+import hashlib
+import sqlite3
+from pathlib import Path
+
+from .doc_index import get_digest
+
+
+# Documents may be assigned to shards round-robin ("ordinal"), or by a hash of their
+#  content ("hash"), which sends identical documents to the same shard.
+SHARD_BY = ("ordinal", "hash")
+
+
+def get_file_offset(filepath, shard_count):
+    """Return a stable offset for the round-robin assignment of the documents in
+    `filepath`, so that the shards which get one more document than the others vary
+    from file to file.  Only the name of the file is used, so the offset is the same on
+    every node, wherever the file is found."""
+    digest = hashlib.blake2b(Path(filepath).name.encode("utf8"), digest_size=8)
+    return int.from_bytes(digest.digest(), "big") % shard_count
+
+
+def get_doc_shard(ordinal, digest, file_offset, shard_count, shard_by="ordinal"):
+    """Return the shard to which the `ordinal`th document of a file, whose content has
+    the (hex) `digest` from get_digest(), is assigned."""
+    if shard_by == "hash":
+        return int(digest, 16) % shard_count
+    return (file_offset + ordinal) % shard_count
+
+
+def yield_shard_payloads(
+    payloads, filepath, shard_index, shard_count, shard_by="ordinal"
+):
+    """Yield only those of the payloads for the documents of `filepath` which belong to
+    shard `shard_index` of `shard_count`."""
+    file_offset = get_file_offset(filepath, shard_count)
+    for ordinal, payload in enumerate(payloads):
+        digest = get_digest(payload["doc"]) if shard_by == "hash" else None
+        if (
+            get_doc_shard(ordinal, digest, file_offset, shard_count, shard_by)
+            == shard_index
+        ):
+            yield payload
+
+
+def select_shard_entries(
+    entries, filepath, shard_index, shard_count, shard_by="ordinal"
+):
+    """As yield_shard_payloads(), for the DocEntries of a document index (whose digests
+    are recorded, so the documents needn't be read)."""
+    file_offset = get_file_offset(filepath, shard_count)
+    return [
+        entry
+        for ordinal, entry in enumerate(entries)
+        if get_doc_shard(ordinal, entry.digest, file_offset, shard_count, shard_by)
+        == shard_index
+    ]
+
+
+def merge_sqlite_dbs(output_path, shard_paths):
+    """Merge the tables of the SQLite databases at `shard_paths` (as written by shards
+    of a run) into the database at `output_path`, which is created if necessary."""
+    conn = sqlite3.connect(str(output_path), isolation_level=None)
+    merge_sqlite_into(conn, shard_paths)
+    conn.close()
+
+
+def merge_sqlite_into(conn, shard_paths):
+    """Merge the tables of the SQLite databases at `shard_paths` into the database of
+    `conn` (which must be in autocommit mode), one transaction per shard.  Tables
+    missing from the output are created as they're defined in the first shard that has
+    them, and columns missing from existing tables are added."""
+    for shard_path in shard_paths:
+        conn.execute("ATTACH DATABASE ? AS shard;", (str(shard_path),))
+        conn.execute("BEGIN;")
+        for table_name, table_sql in conn.execute(
+            "SELECT name, sql FROM shard.sqlite_master WHERE type = 'table';"
+        ).fetchall():
+            columns = [
+                row[1]
+                for row in conn.execute(f"PRAGMA shard.table_info([{table_name}]);")
+            ]
+            existing = [
+                row[1]
+                for row in conn.execute(f"PRAGMA main.table_info([{table_name}]);")
+            ]
+            if not existing:
+                conn.execute(table_sql)
+            else:
+                for column in columns:
+                    if column not in existing:
+                        conn.execute(
+                            f"ALTER TABLE [{table_name}] ADD COLUMN [{column}] TEXT;"
+                        )
+
+            column_list = ", ".join(f"[{column}]" for column in columns)
+            conn.execute(
+                f"INSERT INTO main.[{table_name}] ({column_list}) "
+                f"SELECT {column_list} FROM shard.[{table_name}];"
+            )
+        conn.execute("COMMIT;")
+        conn.execute("DETACH DATABASE shard;")
+
+
+def merge_csv_dirs(output_path, shard_paths):
+    """Concatenate the CSV files in the directories at `shard_paths` (as written by
+    shards of a run) into files of the same names in the directory at `output_path`.
+    Each output file has the header of the first shard with that file, and rows are
+    aligned to it by column name."""
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    for shard_path in shard_paths:
+        for shard_file in sorted(Path(shard_path).glob("*.csv")):
+            output_file = output_path / shard_file.name
+            with shard_file.open(newline="") as _in:
+                reader = csv.DictReader(_in)
+                if reader.fieldnames is None:
+                    # empty file
+                    continue
+
+                if output_file.exists():
+                    with output_file.open(newline="") as _fh:
+                        fieldnames = next(csv.reader(_fh), None)
+                    mode = "a"
+                else:
+                    fieldnames, mode = None, "w"
+
+                with output_file.open(mode, newline="") as _out:
+                    writer = csv.DictWriter(
+                        _out,
+                        fieldnames=fieldnames or reader.fieldnames,
+                        extrasaction="ignore",
+                    )
+                    if fieldnames is None:
+                        writer.writeheader()
+                    writer.writerows(reader)
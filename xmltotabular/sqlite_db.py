@@ -20,6 +20,13 @@ SQLITE_MAX_VARIABLE_NUMBER = 999
 # See: https://www.sqlite.org/limits.html#max_column
 SQLITE_MAX_COLUMN = 2000
 
+# Strategies available to Table.insert_all():
+#  - "multi_values" builds `INSERT ... VALUES (...), (...), ...` statements inserting
+#     as many rows as SQLITE_MAX_VARIABLE_NUMBER allows at once;
+#  - "executemany" runs a single prepared `INSERT ... VALUES (...)` statement over the
+#     records, which may be any iterable (a generator, for example).
+INSERT_ENGINES = ("multi_values", "executemany")
+
 
 COLUMN_TYPE_MAPPING = {
     float: "FLOAT",
@@ -40,16 +47,28 @@ COLUMN_TYPE_MAPPING = {
 
 
 class SqliteDB:
-    def __init__(self, path, max_vars=None):
+    def __init__(self, path, max_vars=None, insert_engine="multi_values"):
+        assert (
+            insert_engine in INSERT_ENGINES
+        ), f"insert_engine must be one of {', '.join(INSERT_ENGINES)}"
         self.path = path
         self.max_vars = max_vars or SQLITE_MAX_VARIABLE_NUMBER
+        self.insert_engine = insert_engine
+        # the connection may be handed to a writer thread (but is only ever used by one
+        #  thread at a time)
         if path == ":memory:":
-            self.conn = sqlite3.connect(":memory:")
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
         else:
-            self.conn = sqlite3.connect(str(path), isolation_level=None)
+            self.conn = sqlite3.connect(
+                str(path), isolation_level=None, check_same_thread=False
+            )
         self.conn.execute("PRAGMA synchronous = OFF;")
         self.conn.execute("PRAGMA journal_mode = MEMORY;")
         self.conn.execute("PRAGMA locking_mode = EXCLUSIVE;")
+        # columns by table name, as read from `PRAGMA table_info`; schema changes made
+        #  other than through Table.create() and Table.add_column() should be followed
+        #  by a call to invalidate_schema()
+        self.schema_cache = {}
 
     def __getitem__(self, table_name):
         return Table(self, table_name)
@@ -57,6 +76,15 @@ class SqliteDB:
     def __repr__(self):
         return "<Database: {}>".format(self.path)
 
+    def invalidate_schema(self, table_name=None):
+        if table_name is None:
+            self.schema_cache.clear()
+        else:
+            self.schema_cache.pop(table_name, None)
+
+    def close(self):
+        self.conn.close()
+
     def table_names(self):
         sql = "SELECT name FROM sqlite_master WHERE type = 'table';"
         return [r[0] for r in self.execute(sql).fetchall()]
@@ -107,6 +135,7 @@ class SqliteDB:
             column_order=column_order,
         )
         self.execute(sql)
+        self.invalidate_schema(name)
         return Table(self, name)
 
 
@@ -117,8 +146,16 @@ class Table:
 
     @property
     def columns(self):
-        rows = self.db.execute("PRAGMA table_info([{}])".format(self.name)).fetchall()
-        return {row[1]: Column(*row) for row in rows}
+        if self.name not in self.db.schema_cache:
+            rows = self.db.execute(
+                "PRAGMA table_info([{}])".format(self.name)
+            ).fetchall()
+            self.db.schema_cache[self.name] = {row[1]: Column(*row) for row in rows}
+        return self.db.schema_cache[self.name]
+
+    @property
+    def column_names(self):
+        return tuple(self.columns)
 
     @property
     def schema(self):
@@ -151,32 +188,58 @@ class Table:
             table=self.name, col_name=col_name, col_type=COLUMN_TYPE_MAPPING[col_type]
         )
         self.db.execute(sql)
+        self.db.invalidate_schema(self.name)
         return self
 
-    def generate_insert_batches(self, records):
+    def generate_insert_batches(self, records, column_names=None):
         def batches(records, max_batch_size):
             """Yield successive batches of `records` of size `max_batch_size`."""
-            for i in range(0, len(records), max_batch_size):
-                yield records[i : i + max_batch_size]
-
-        num_columns = len(self.columns)
+            records = iter(records)
+            while True:
+                batch = list(itertools.islice(records, max_batch_size))
+                if not batch:
+                    return
+                yield batch
+
+        if column_names is None:
+            column_names = self.column_names
+            # (converted batch by batch, as they're inserted)
+            records = (
+                [record.get(key, None) for key in column_names] for record in records
+            )
+        num_columns = len(column_names)
 
         max_batch_size = self.db.max_vars // num_columns
-        columns = ", ".join(f"[{c}]" for c in self.columns)
+        columns = ", ".join(f"[{c}]" for c in column_names)
         placeholders = ", ".join("?" * num_columns)
 
         for batch in batches(records, max_batch_size):
-            params = [
-                [record.get(key, None) for key in self.columns] for record in batch
-            ]
             rows = ", ".join(f"({placeholders})" for record in batch)
             sql = f"INSERT INTO [{self.name}] ({columns}) VALUES {rows};"
-            yield (sql, list(itertools.chain(*params)))
-
-    def insert_all(self, records):
-        for sql, params in self.generate_insert_batches(records):
-            self.db.execute(sql, params)
-        self.db.conn.commit()
+            yield (sql, list(itertools.chain.from_iterable(batch)))
+
+    def insert_sql(self, column_names=None):
+        if column_names is None:
+            column_names = self.column_names
+        columns = ", ".join(f"[{c}]" for c in column_names)
+        placeholders = ", ".join("?" * len(column_names))
+        return f"INSERT INTO [{self.name}] ({columns}) VALUES ({placeholders});"
+
+    def insert_all(self, records, commit=True, column_names=None):
+        """Insert `records`, which are dicts, or, if `column_names` is given, sequences
+        of the values for those columns (which needn't be looked up by name)."""
+        if self.db.insert_engine == "executemany":
+            if column_names is None:
+                column_names = self.column_names
+                records = (
+                    tuple(record.get(key) for key in column_names) for record in records
+                )
+            self.db.conn.executemany(self.insert_sql(column_names), records)
+        else:
+            for sql, params in self.generate_insert_batches(records, column_names):
+                self.db.execute(sql, params)
+        if commit:
+            self.db.conn.commit()
 
 
 Column = namedtuple(
@@ -0,0 +1,95 @@
+from collections import namedtuple
+
+from . import plan
+from .plan import NotSimplePath, split_simple_path, to_clark
+
+
+# The streaming engine parses a document in chunks of this many bytes, and processes
+#  each of its records (the elements found by the only top-level path of a config, if
+#  it's a simple path to an entity) as soon as its end tag has been parsed, removing it
+#  from the tree -- so that only one chunk's worth of records is ever held in memory,
+#  rather than the whole document.  Records are lxml elements like any other, to which
+#  the rest of the plan is applied exactly as by the tree engine.  Documents no larger
+#  than a chunk gain nothing from this, so are parsed whole, by the tree engine.
+STREAM_CHUNK_BYTES = 1 << 16
+
+# `path_plan` is the top-level PathPlan of the records, and `steps` the tags (in Clark
+#  notation) of the elements on the path from the root element to each record.
+RecordPath = namedtuple("RecordPath", ("path_plan", "steps"))
+
+
+def iter_plan_paths(extraction_plan):
+    """Yield every XPath expression (including primary key components) in a plan."""
+
+    def iter_action_paths(action):
+        if action.kind == plan.ENTITY:
+            for expression, _xpath in action.primary_key or ():
+                yield expression
+            for path_plan in action.fields:
+                yield path_plan.path
+                yield from iter_action_paths(path_plan.action)
+        elif action.kind == plan.MULTIPLE:
+            for subaction in action.actions:
+                yield from iter_action_paths(subaction)
+
+    for path_plan in extraction_plan.paths:
+        yield path_plan.path
+        yield from iter_action_paths(path_plan.action)
+
+
+def is_streamable(extraction_plan):
+    """Return True if all the paths in a plan are simple paths (see plan.py), which
+    can't refer to anything outside the elements they're evaluated from."""
+    try:
+        for path in iter_plan_paths(extraction_plan):
+            split_simple_path(path)
+    except NotSimplePath:
+        return False
+    return True
+
+
+def get_record_tag(config):
+    """Return the tag of the elements which may be the records of a config (in any
+    namespace, since the namespaces of a document aren't known until it's parsed), for
+    the parser to report the end of, or None if the config has no records."""
+    paths = [key for key in config if not key.startswith("<")]
+    if len(paths) != 1:
+        return None
+    try:
+        steps, attr = split_simple_path(paths[0])
+    except NotSimplePath:
+        return None
+    if attr is not None:
+        return None
+    return "{*}" + steps[-1].split(":")[-1]
+
+
+def compile_record_path(extraction_plan):
+    """Return the RecordPath of a plan whose records can be processed as they're
+    parsed, or None.  Records can be processed that way if the only top-level path of
+    the plan is a simple path to an entity, all of whose paths are simple paths, none
+    of them referring to the record itself (whose text includes its tail, which is
+    parsed only after its end tag).  Raises NotSimplePath if a namespace prefix is
+    unknown."""
+    if len(extraction_plan.paths) != 1 or not is_streamable(extraction_plan):
+        return None
+
+    path_plan = extraction_plan.paths[0]
+    steps, attr = split_simple_path(path_plan.path)
+    if attr is not None or path_plan.action.kind != plan.ENTITY:
+        return None
+    if any(field.path == steps[-1] for field in path_plan.action.fields):
+        return None
+
+    return RecordPath(
+        path_plan, tuple(to_clark(step, extraction_plan.ns_map) for step in steps)
+    )
+
+
+def is_record(elem, steps):
+    """Return True if `elem` is found by the path with `steps` from the root element."""
+    for tag in reversed(steps):
+        if elem is None or elem.tag != tag:
+            return False
+        elem = elem.getparent()
+    return elem is not None and elem.getparent() is None
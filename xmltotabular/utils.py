@@ -1,5 +1,14 @@
+import bz2
 import gzip
+import json
+import lzma
+import mmap
+import queue
+import re
 import sys
+import tarfile
+import threading
+import zipfile
 from collections import defaultdict
 from pathlib import Path
 from pprint import pformat
@@ -47,13 +56,42 @@ class DTDResolver(etree.Resolver):
     def __init__(self, dtd_path):
         self.dtd_path = Path(dtd_path)
 
-    def resolve(self, system_url, _public_id, context):
+    def get_filename(self, system_url):
         if system_url.startswith(str(self.dtd_path)):
-            return self.resolve_filename(system_url, context)
-        else:
-            return self.resolve_filename(
-                str((self.dtd_path / system_url).resolve()), context
-            )
+            return system_url
+        return str((self.dtd_path / system_url).resolve())
+
+    def resolve(self, system_url, _public_id, context):
+        return self.resolve_filename(self.get_filename(system_url), context)
+
+
+class CachingDTDResolver(DTDResolver):
+    """A DTDResolver which reads each DTD (or entity file) from disk only once, and
+    serves it from memory thereafter.  If no base path is supplied, system URLs are
+    taken to be filenames (relative to the working directory), and those which can't be
+    read are left to the parser to resolve."""
+
+    def __init__(self, dtd_path=None):
+        self.dtd_path = Path(dtd_path) if dtd_path else None
+        self.cache = {}
+
+    def get_filename(self, system_url):
+        if self.dtd_path is None:
+            return system_url
+        return super().get_filename(system_url)
+
+    def resolve(self, system_url, _public_id, context):
+        filename = self.get_filename(system_url)
+        if filename not in self.cache:
+            try:
+                self.cache[filename] = Path(filename).read_bytes()
+            except OSError:
+                self.cache[filename] = None
+        if self.cache[filename] is None:
+            return None
+        # the filename is passed as the base URL so that files referenced from this
+        #  one are resolved relative to it
+        return self.resolve_string(self.cache[filename], context, base_url=filename)
 
 
 class WrongDoctypeException(Exception):
@@ -64,64 +102,604 @@ class NoDoctypeException(Exception):
     """Used to indicate that an XML doc does not specify a DOCTYPE."""
 
 
+# Matches a DOCTYPE declaration preceded only by whitespace, processing instructions
+#  (including the XML declaration) and comments -- i.e. in the document's prolog, before
+#  the root element's start tag -- capturing the declaration (to the end of its line) and
+#  the name of the root element it declares.  The alternatives can't overlap, so a
+#  failed match is cheap, however large the document.
+PROLOG_PATTERN = r"(?:\s|<\?(?:[^?]|\?(?!>))*\?>|<!--(?:[^-]|-(?!->))*-->)*"
+PROLOG_DOCTYPE_PATTERN = PROLOG_PATTERN + r"(<!DOCTYPE\s+([^\s\[>]+)[^\n]*)"
+PROLOG_DOCTYPE = {
+    str: re.compile(PROLOG_DOCTYPE_PATTERN),
+    bytes: re.compile(PROLOG_DOCTYPE_PATTERN.encode("ascii")),
+}
+BYTE_ORDER_MARKS = {str: "\ufeff", bytes: b"\xef\xbb\xbf"}
+
+# Matches the start of a DOCTYPE declaration in the prolog with a non-empty internal
+#  subset: the declaration's name and external ID (if any), then "[" followed by
+#  anything other than whitespace and "]".
+PROLOG_INTERNAL_SUBSET = re.compile(
+    (
+        PROLOG_PATTERN
+        + r"<!DOCTYPE\s+[^\s\[>]+"
+        + r"(?:\s+(?:\"[^\"]*\"|'[^']*'|[^\s\[>\"']+))*"
+        + r"\s*\[\s*[^\s\]]"
+    ).encode("ascii")
+)
+
+
+def has_internal_subset(doc):
+    """Return True if an XML document (passed as bytes) has a DOCTYPE declaration with
+    a non-empty internal DTD subset.  Only the prolog of the document is examined."""
+    bom = BYTE_ORDER_MARKS[bytes]
+    return (
+        PROLOG_INTERNAL_SUBSET.match(doc, len(bom) if doc[: len(bom)] == bom else 0)
+        is not None
+    )
+
+
 def test_doctype(doc, root_element):
-    """Test an XML document (passed as a string) for a DOCTYPE declaration that matches
-    `root_element`."""
-    for line in doc.split("\n"):
-        if line.split()[:2] == ["<!DOCTYPE", root_element]:
-            return True
-        elif line.startswith("<!DOCTYPE "):
-            raise WrongDoctypeException(line)
+    """Test an XML document (passed as a string or as bytes) for a DOCTYPE declaration
+    that matches `root_element`.  Only the prolog of the document is examined."""
+    doc_type = bytes if isinstance(doc, (bytes, bytearray, memoryview)) else str
+    bom = BYTE_ORDER_MARKS[doc_type]
+    match = PROLOG_DOCTYPE[doc_type].match(
+        doc, len(bom) if doc[: len(bom)] == bom else 0
+    )
+
+    if match is None:
+        raise NoDoctypeException()
+
+    declaration, name = match.groups()
+    if doc_type is bytes:
+        declaration = declaration.decode("utf8", errors="replace")
+        name = name.decode("utf8", errors="replace")
+
+    if name == root_element:
+        return True
 
-    raise NoDoctypeException()
+    raise WrongDoctypeException(declaration)
 
 
-def get_stream(filepath):
+COMPRESSION_OPENERS = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+
+
+def sniff_compression(filepath):
+    """Return the compression format of `filepath` ("gzip", "bz2" or "xz"), according
+    to its magic bytes, or None if it isn't compressed (in a format we recognize)."""
     with open(filepath, "rb") as _fh:
-        two_bytes = _fh.read(2)
+        head = _fh.read(6)
+
+    if head[:2] == b"\x1f\x8b":
+        return "gzip"
+    if head[:3] == b"BZh" and head[3:4].isdigit():
+        return "bz2"
+    if head == b"\xfd7zXZ\x00":
+        return "xz"
+    return None
+
+
+class ReadAheadStream:
+    """Wrap a binary stream so that it's read (and, for compressed streams,
+    decompressed) in a background thread, up to `depth` chunks ahead of the consumer.
+    The decompressors release the GIL, so decompression overlaps with whatever the
+    consumer is doing."""
+
+    def __init__(self, stream, chunk_size=None, depth=4):
+        self.stream = stream
+        self.chunk_size = chunk_size or STREAM_CHUNK_SIZE
+        self.queue = queue.Queue(depth)
+        self.buffer = b""
+        self.pos = 0
+        self.eof = self.closed = False
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+    def fill(self):
+        try:
+            while not self.closed:
+                chunk = self.stream.read(self.chunk_size)
+                self.put(chunk)
+                if not chunk:
+                    return
+        except Exception as exc:  # re-raised in the consuming thread
+            self.put(exc)
+
+    def put(self, item):
+        # poll, so that the thread can be stopped by close() even if the queue is full
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, size=-1):
+        remaining = None if size is None or size < 0 else size
+        chunks = []
+
+        while remaining is None or remaining > 0:
+            if self.pos == len(self.buffer):
+                if self.eof:
+                    break
+                item = self.queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                self.eof = not item
+                self.buffer, self.pos = item, 0
+                continue
+
+            end = len(self.buffer)
+            if remaining is not None:
+                end = min(end, self.pos + remaining)
+                remaining -= end - self.pos
+            chunks.append(self.buffer[self.pos : end])
+            self.pos = end
+
+        return b"".join(chunks)
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+        self.stream.close()
+
+
+def get_stream(filepath, read_ahead=True):
+    """Open `filepath` as a binary stream, decompressing it if necessary (in a
+    read-ahead thread, unless `read_ahead` is False).  Decoding is left to the XML
+    parser, which respects the encoding declared by each document."""
+    compression = sniff_compression(filepath)
+
+    if compression is None:
+        return open(filepath, "rb")
+
+    stream = COMPRESSION_OPENERS[compression](filepath, "rb")
+    return ReadAheadStream(stream) if read_ahead else stream
+
+
+XML_DECLARATION = b"<?xml "
+
+# Size of the blocks read from streams which can't be memory-mapped (i.e. compressed
+#  inputs) when splitting them into documents.
+STREAM_CHUNK_SIZE = 1 << 20
+
+LEADING_WHITESPACE = re.compile(rb"\s*")
+
+
+def scan_buffer(buffer):
+    """Yield a `(start, end, linenum, doc)` tuple for each XML document in `buffer`."""
+    size = len(buffer)
+    # leading whitespace is skipped (matching the regex against the buffer directly
+    #  avoids copying it if it's an mmap)
+    start = LEADING_WHITESPACE.match(buffer).end()
+    linenum = buffer[:start].count(b"\n")
+
+    while start < size:
+        end = buffer.find(XML_DECLARATION, start + 1)
+        if end == -1:
+            end = size
+        doc = buffer[start:end]
+        yield start, end, linenum, doc
+        linenum += doc.count(b"\n")
+        start = end
+
+
+def split_xml_docs(buffer):
+    """Given a buffer (`bytes`, an `mmap`, etc.) containing one or more concatenated XML
+    documents, yield a `(start, end, linenum)` tuple for each document, where `start` and
+    `end` are byte offsets into the buffer and `linenum` is the (zero-indexed) line on
+    which the document starts.
+
+    Documents are delimited by `<?xml ` declarations wherever they occur (not only at the
+    start of a line, since documents are sometimes concatenated without adequate
+    interpolation of new-lines).
+    """
+    for start, end, linenum, _doc in scan_buffer(buffer):
+        yield start, end, linenum
+
+
+def split_xml_stream(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """As `split_xml_docs()`, but for a binary file-like object which can't be mapped
+    into memory (a decompressing stream, for example).  Yields `(start, end, linenum,
+    doc)` tuples, where offsets are into the (decompressed) stream and `doc` is the
+    document as `bytes`."""
+    buffer = bytearray()
+    offset = linenum = 0
+    # the position in the buffer from which to look for the next declaration
+    search_from = 1
+    started = False
+
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+
+        if not started:
+            skip = LEADING_WHITESPACE.match(buffer).end()
+            linenum += buffer.count(b"\n", 0, skip)
+            offset += skip
+            del buffer[:skip]
+            started = bool(buffer)
+
+        while started:
+            end = buffer.find(XML_DECLARATION, search_from)
+            if end == -1:
+                break
+            doc = bytes(buffer[:end])
+            yield offset, offset + end, linenum, doc
+            linenum += doc.count(b"\n")
+            offset += end
+            del buffer[:end]
+            search_from = 1
+
+        if not chunk:
+            break
+
+        # a declaration may straddle the boundary between this chunk and the next
+        search_from = max(1, len(buffer) - len(XML_DECLARATION) + 1)
+
+    if buffer:
+        yield offset, offset + len(buffer), linenum, bytes(buffer)
+
+
+def is_mappable(filepath):
+    """Return True if `filepath` is an uncompressed file (and not an archive) which can
+    be memory-mapped."""
+    return (
+        Path(filepath).stat().st_size > 0
+        and sniff_compression(filepath) is None
+        and not is_archive(filepath)
+    )
 
-    if two_bytes == b"\x1f\x8b":
-        return gzip.open(filepath, "rt", errors="replace")
 
-    return open(filepath, "r", errors="replace")
+def iter_xml_docs(filepath):
+    """Given a path to a file containing one or more XML documents, yield a `(start,
+    end, linenum, doc)` tuple for each document.  Uncompressed files are memory-mapped
+    and scanned in place; compressed files are scanned as a stream."""
+    if not is_mappable(filepath):
+        with get_stream(filepath) as _fh:
+            yield from split_xml_stream(_fh)
+        return
+
+    with open(filepath, "rb") as _fh, mmap.mmap(
+        _fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        yield from scan_buffer(buffer)
+
+
+def yield_xml_doc_offsets(filepath):
+    """Given a path to a file containing one or more XML documents, yield a `(start,
+    end, linenum)` tuple for each document, so that the document can subsequently be
+    read with `read_xml_doc()` (or sliced from a mapping of the file).
+
+    For compressed files, offsets are into the decompressed content.
+    """
+    for start, end, linenum, _doc in iter_xml_docs(filepath):
+        yield start, end, linenum
+
+
+def read_xml_doc(filepath, start, end):
+    """Read the document at byte offsets `start` to `end` from `filepath`."""
+    with get_stream(filepath, read_ahead=False) as _fh:
+        _fh.seek(start)
+        return _fh.read(end - start)
+
+
+ARCHIVE_SUFFIXES = (
+    ".zip",
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.xz",
+    ".txz",
+)
+
+
+def is_archive(filepath):
+    """Return True if `filepath` is a zip or tar archive (judged first by its name)."""
+    if not Path(filepath).name.lower().endswith(ARCHIVE_SUFFIXES):
+        return False
+    return zipfile.is_zipfile(filepath) or tarfile.is_tarfile(filepath)
+
+
+def iter_archive_members(filepath):
+    """Given a path to a zip or tar archive, yield a `(name, stream)` tuple for each XML
+    file it contains, reading members in place rather than extracting them."""
+    if zipfile.is_zipfile(filepath):
+        with zipfile.ZipFile(filepath) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(".xml"):
+                    with ReadAheadStream(archive.open(info)) as stream:
+                        yield info.filename, stream
+        return
+
+    # the (decompressed) archive is read as a stream, so that members of compressed tar
+    #  archives don't each require decompressing the archive from the start
+    with get_stream(filepath) as stream, tarfile.open(
+        fileobj=stream, mode="r|"
+    ) as archive:
+        for info in archive:
+            if info.isfile() and info.name.lower().endswith(".xml"):
+                yield info.name, archive.extractfile(info)
 
 
 def yield_xml_doc(filepath):
     """Given a path to a file containing one or more XML documents, for each document
-    yield a dictionary containing a document, the filename, and the ending line number
-    at which the document is found."""
+    yield a dictionary containing a document (as `bytes`), the filename, and the
+    (zero-indexed) line number at which the document starts.
+
+    Archives are read member by member, and the filename is that of the member.
+    """
+    if is_archive(filepath):
+        for name, stream in iter_archive_members(filepath):
+            for _start, _end, linenum, doc in split_xml_stream(stream):
+                yield {"filename": name, "linenum": linenum, "doc": doc}
+        return
+
     filename = filepath.resolve().name
-    xml_doc = []
-
-    with get_stream(filepath) as _fh:
-        for i, line in enumerate(_fh):
-            if xml_doc and line.startswith("<?xml "):
-                yield {
-                    "filename": filename,
-                    "linenum": i - len(xml_doc),
-                    "doc": "".join(xml_doc),
-                }
-                xml_doc = []
-
-            # handle the case where documents have been concatenated without
-            #  adequate interpolation of new-lines
-            elif xml_doc and "<?xml " in line:
-                xml_doc.append(line[: line.find("<?xml ")])
-                line = line[line.find("<?xml ") :]
-                yield {
-                    "filename": filename,
-                    "linenum": i - len(xml_doc),
-                    "doc": "".join(xml_doc),
-                }
-                xml_doc = []
-
-            xml_doc.append(line)
 
+    for _start, _end, linenum, doc in iter_xml_docs(filepath):
+        yield {
+            "filename": filename,
+            "linenum": linenum,
+            "doc": bytes(doc),
+        }
+
+
+def yield_xml_records(filepath, record_element, dtd_path=None):
+    """Given a path to a (single) XML document containing repeated `record_element`
+    elements, yield a dictionary for each record, in the same form as yield_xml_doc(),
+    where the document is the serialized record subtree.
+
+    The file is parsed incrementally, and each record (along with anything that precedes
+    it) is discarded once it has been yielded, so memory use doesn't grow with the size
+    of the file.  `record_element` may be a local name (matched in any namespace) or a
+    name in Clark notation (i.e. "{namespace}local-name").
+
+    Each XML file in an archive is treated as such a document.
+    """
+    if is_archive(filepath):
+        for name, stream in iter_archive_members(filepath):
+            yield from iterparse_records(stream, name, record_element, dtd_path)
+        return
+
+    with get_stream(filepath) as stream:
+        yield from iterparse_records(
+            stream, filepath.resolve().name, record_element, dtd_path
+        )
+
+
+def iterparse_records(stream, filename, record_element, dtd_path=None):
+    tag = record_element if record_element.startswith("{") else f"{{*}}{record_element}"
+
+    context = etree.iterparse(
+        stream,
+        events=("end",),
+        tag=tag,
+        load_dtd=True,
+        resolve_entities=True,
+        huge_tree=True,
+        collect_ids=False,
+    )
+    context.resolvers.add(CachingDTDResolver(dtd_path))
+
+    for _event, elem in context:
         yield {
             "filename": filename,
-            "linenum": i - len(xml_doc),
-            "doc": "".join(xml_doc),
+            "linenum": elem.sourceline - 1,
+            "doc": etree.tostring(elem, with_tail=False),
         }
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+# Sidecar indexes (see gzip_index and doc_index) record the version of their format,
+#  and are discarded if it doesn't match.
+INDEX_VERSION = 1
+
+
+def get_index_path(filepath, suffix, cache_dir=None):
+    """Return the path of a sidecar index for `filepath` -- alongside it, or in
+    `cache_dir` if supplied."""
+    filepath = Path(filepath).resolve()
+    if cache_dir is None:
+        return filepath.with_name(filepath.name + suffix)
+    # include the parent directory's name, to make collisions less likely
+    return Path(cache_dir) / f"{filepath.parent.name}_{filepath.name}{suffix}"
+
+
+def file_signature(filepath):
+    stat = Path(filepath).stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def read_index(index_path, filepath):
+    """Return the contents of a sidecar index, or None if it doesn't exist or is
+    stale (i.e. the size or modification time of `filepath` has changed)."""
+    try:
+        index = json.loads(Path(index_path).read_text())
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION or any(
+        index.get(key) != value for key, value in file_signature(filepath).items()
+    ):
+        return None
+    return index
+
+
+def write_index(index_path, filepath, **index):
+    """Write a sidecar index, if possible (an index which can't be written is simply
+    rebuilt next time)."""
+    index.update(version=INDEX_VERSION, **file_signature(filepath))
+    try:
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(index_path).write_text(json.dumps(index))
+    except OSError:
+        pass
+
+
+# Batches of documents sent to workers are filled up to this many bytes (unless a
+#  fixed batch size is given), so that small documents share the cost of a round trip
+#  to a worker while large documents are still dispatched individually.
+BATCH_BYTES = 1 << 20
+MAX_BATCH_SIZE = 1000
+# ... but the documents of a smaller input are spread across at least this many batches
+#  per worker process, so that no worker is left idle while the input is processed.
+BATCHES_PER_PROCESS = 4
+
+
+def get_batch_bytes(input_size, processes):
+    """Return the number of bytes to fill batches to for an input of `input_size`
+    bytes, processed by `processes` workers."""
+    return max(1, min(BATCH_BYTES, input_size // (processes * BATCHES_PER_PROCESS)))
+
+
+def get_doc_size(payload):
+    return len(payload.get("doc", b""))
+
+
+def batch_payloads(
+    payloads, batch_size=None, batch_bytes=BATCH_BYTES, get_size=get_doc_size
+):
+    """Group payloads yielded by yield_xml_doc() into lists, either of `batch_size`
+    documents or, if `batch_size` is not given, of as many documents as fit in
+    `batch_bytes` (and no more than MAX_BATCH_SIZE)."""
+    batch, size = [], 0
+    for payload in payloads:
+        batch.append(payload)
+        size += get_size(payload)
+        if batch_size:
+            full = len(batch) == batch_size
+        else:
+            full = size >= batch_bytes or len(batch) == MAX_BATCH_SIZE
+        if full:
+            yield batch
+            batch, size = [], 0
+
+    if batch:
+        yield batch
+
+
+class DocFilter:
+    """A predicate on the raw bytes of documents, from the `<filter>` key of a config,
+    for selecting documents before they're parsed.  `<filter>` may be a regular
+    expression (or a list of them), or a mapping with any of:
+
+        <pattern>: a regular expression, or a list of them
+        <literal>: a literal string, or a list of them
+        <head_bytes>: test only the first N bytes of each document
+        <exclude>: if true, skip documents that match, rather than those that don't
+
+    A document matches if any of the patterns or literals is found in it."""
+
+    def __init__(self, config):
+        if not isinstance(config, dict):
+            config = {"<pattern>": config}
+
+        def as_list(value):
+            if value is None:
+                return []
+            return value if isinstance(value, list) else [value]
+
+        patterns = [
+            pattern.encode("utf8") if isinstance(pattern, str) else pattern
+            for pattern in as_list(config.get("<pattern>"))
+        ]
+        patterns += [
+            re.escape(literal.encode("utf8") if isinstance(literal, str) else literal)
+            for literal in as_list(config.get("<literal>"))
+        ]
+        if not patterns:
+            raise ValueError("<filter> must specify at least one <pattern> or <literal>")
+
+        self.regex = re.compile(b"|".join(b"(?:%s)" % pattern for pattern in patterns))
+        self.head_bytes = config.get("<head_bytes>")
+        self.exclude = bool(config.get("<exclude>", False))
+
+    def matches(self, doc):
+        """Return True if `doc` (bytes, or a string) should be processed."""
+        if self.head_bytes is not None:
+            doc = doc[: self.head_bytes]
+        if isinstance(doc, str):
+            doc = doc.encode("utf8")
+        return (self.regex.search(doc) is None) is self.exclude
+
+
+class InFlightLimiter:
+    """Limit the number of items taken from an iterable (by a Pool's task handler, for
+    example) which have not yet been released by the consumer of the results."""
+
+    def __init__(self, limit):
+        self.semaphore = threading.Semaphore(limit)
+        self.closed = False
+
+    def feed(self, iterable):
+        for item in iterable:
+            # poll, rather than blocking indefinitely, so that the thread iterating
+            #  this generator can be stopped (e.g. by Pool.terminate()) with close()
+            while not self.semaphore.acquire(timeout=0.1):
+                if self.closed:
+                    return
+            yield item
+
+    def release(self):
+        self.semaphore.release()
+
+    def close(self):
+        self.closed = True
+
+
+class BackgroundWriter:
+    """Call `write()` on items in a thread of its own, so that the caller can carry on
+    (collecting results from workers, say) while they're written.  At most `depth`
+    items wait to be written, beyond which put() blocks.  An exception raised by
+    `write()` is re-raised in the calling thread by the next put(), or by close()."""
+
+    def __init__(self, write, depth=2):
+        self.write = write
+        self.queue = queue.Queue(depth)
+        self.exception = None
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # after an error (or cancellation), items are discarded, so that put()
+            #  doesn't block
+            if self.exception is None and not self.cancelled:
+                try:
+                    self.write(item)
+                except Exception as exc:  # re-raised in the calling thread
+                    self.exception = exc
+
+    def raise_exception(self):
+        if self.exception is not None:
+            raise self.exception
+
+    def put(self, item):
+        self.raise_exception()
+        self.queue.put(item)
+
+    def close(self, cancel=False):
+        """Wait for queued items to be written (or, with `cancel`, discard them), and
+        stop the thread."""
+        self.cancelled = cancel
+        self.queue.put(None)
+        self.thread.join()
+        if not cancel:
+            self.raise_exception()
 
 
 def get_fieldnames_from_config(full_config):
@@ -1,11 +1,23 @@
 import csv
 import logging
+import os
+import shutil
 import sys
+import tempfile
 from collections import defaultdict
 from pathlib import Path
 
 import yaml
 
+from .doc_index import load_doc_index, read_doc_range, yield_doc_ranges
+from .gzip_index import is_gzip, split_gzip_range, yield_gzip_ranges
+from .shards import (
+    SHARD_BY,
+    merge_csv_dirs,
+    merge_sqlite_into,
+    select_shard_entries,
+    yield_shard_payloads,
+)
 from .sqlite_db import SqliteDB
 from .utils import (
     expand_paths,
@@ -13,11 +25,226 @@ from .utils import (
     Pool,
     cpu_count,
     yield_xml_doc,
+    yield_xml_records,
+    batch_payloads,
+    get_batch_bytes,
+    is_archive,
+    is_mappable,
+    ARCHIVE_SUFFIXES,
+    InFlightLimiter,
+    BackgroundWriter,
+    DocFilter,
     get_fieldnames_from_config,
 )
 from .xmldoctotabular import XmlDocToTabular
 
 
+# Rows are written out whenever this many rows have accumulated, or once rows have been
+#  extracted from this many bytes of XML, so that memory use doesn't grow with the size
+#  of the input files.
+FLUSH_ROWS = 100_000
+FLUSH_BYTES = 256 << 20
+
+# Each worker process builds its own XmlDocToTabular instance once, in init_worker(),
+#  so that tasks sent to the pool need only carry document payloads.
+_worker_doc_parser = None
+# ...and, with `worker_output`, its own PartWriter
+_worker_part_writer = None
+
+
+def init_worker(doc_parser_kwargs, part_writer_kwargs=None):
+    global _worker_doc_parser, _worker_part_writer
+    _worker_doc_parser = XmlDocToTabular(**doc_parser_kwargs)
+    if part_writer_kwargs is not None:
+        _worker_part_writer = PartWriter(**part_writer_kwargs)
+
+
+def process_task_in_worker(task):
+    """Run a task, consisting of a (module-level) function and its argument.  If the
+    worker writes its own output, the rows are written here, and only their number is
+    returned (in place of the tables)."""
+    func, arg = task
+    num_docs, num_bytes, tables, num_skipped = func(arg)
+    if _worker_part_writer is not None:
+        tables = _worker_part_writer.write_tables(tables)
+    return num_docs, num_bytes, tables, num_skipped
+
+
+def check_payloads_in_worker(payloads):
+    """Apply the `<filter>` in the config, and the DOCTYPE check, to those of `payloads`
+    which weren't checked as they were split from their input (i.e. those which workers
+    read for themselves, from indexed files or gzip members), as filter_payloads() does,
+    and return the payloads which pass, and the numbers of documents skipped by the
+    filter and rejected by the check."""
+    doc_parser = _worker_doc_parser
+    checked = []
+    num_filtered = num_rejected = 0
+    for payload in payloads:
+        if payload.get("checked"):
+            checked.append(payload)
+        elif doc_parser.doc_filter is not None and not doc_parser.doc_filter.matches(
+            payload["doc"]
+        ):
+            num_filtered += 1
+        elif (
+            doc_parser.check_doctype
+            and "<record_element>" not in doc_parser.config
+            and not doc_parser.do_doctype_check(
+                payload["doc"], payload["filename"], payload["linenum"]
+            )
+        ):
+            num_rejected += 1
+        else:
+            payload["checked"] = True
+            checked.append(payload)
+    return checked, (num_filtered, num_rejected)
+
+
+def process_batch_in_worker(batch):
+    batch, num_skipped = check_payloads_in_worker(batch)
+    return (
+        len(batch),
+        sum(len(payload["doc"]) for payload in batch),
+        _worker_doc_parser.process_docs_from_pool(batch),
+        num_skipped,
+    )
+
+
+def process_doc_range_in_worker(doc_range):
+    return process_batch_in_worker(read_doc_range(doc_range))
+
+
+def process_gzip_range_in_worker(gzip_range):
+    filename = Path(gzip_range.path).name
+    return process_batch_in_worker(
+        [
+            {"filename": filename, "linenum": linenum, "doc": doc}
+            for _start, _end, linenum, doc in split_gzip_range(gzip_range)
+        ]
+    )
+
+
+def init_sqlite_tables(db, config):
+    """Create the tables for `config` in `db`, or add any columns missing from existing
+    tables."""
+    for tablename, fieldnames in get_fieldnames_from_config(config).items():
+        if tablename in db.table_names():
+            for fieldname in fieldnames:
+                if fieldname not in db[tablename].columns:
+                    db[tablename].add_column(fieldname, str)
+            continue
+        params = {"column_order": fieldnames}
+        if "id" in fieldnames:
+            params["pk"] = "id"
+        db[tablename].create({fieldname: str for fieldname in fieldnames}, **params)
+
+
+def get_row_values(rows, fieldnames):
+    """Return `rows` as tuples of the values of `fieldnames` (see XmlDocToTabular's
+    `tuple_rows`), binding any which are dicts by name."""
+    return [
+        tuple(map(row.get, fieldnames)) if isinstance(row, dict) else row for row in rows
+    ]
+
+
+def write_csv_files(output_path, fieldnames, tables, logger, log_level=logging.INFO):
+    """Write `tables`, whose rows are tuples of the values of the `fieldnames` of their
+    tables (see XmlDocToTabular's `tuple_rows`) or dicts, to CSV files in
+    `output_path`, logging progress at `log_level`."""
+
+    logger.log(
+        log_level,
+        "%s",
+        colored(f"Writing csv files to {output_path.resolve()} ...", "green"),
+    )
+    for tablename, rows in tables.items():
+        rows = get_row_values(rows, fieldnames[tablename])
+        output_file = output_path / f"{tablename}.csv"
+
+        if output_file.exists():
+            logger.debug(
+                "%s",
+                colored(
+                    f"CSV file {output_file} exists; rows will be appended.",
+                    "yellow",
+                ),
+            )
+
+            with output_file.open("a") as _fh:
+                csv.writer(_fh).writerows(rows)
+
+        else:
+            with output_file.open("w") as _fh:
+                writer = csv.writer(_fh)
+                writer.writerow(fieldnames[tablename])
+                writer.writerows(rows)
+
+
+def write_sqlitedb(db, fieldnames, tables, logger, log_level=logging.INFO):
+    """As write_csv_files(), to the SQLite database `db`, in a single transaction."""
+    logger.log(log_level, colored("Writing tables to %s ...", "green"), db.path)
+    db.conn.execute("begin exclusive;")
+    for tablename, rows in tables.items():
+        logger.log(
+            log_level,
+            colored("Writing %d rows to `%s`...", "magenta"),
+            len(rows),
+            tablename,
+        )
+        db[tablename].insert_all(
+            get_row_values(rows, fieldnames[tablename]),
+            commit=False,
+            column_names=fieldnames[tablename],
+        )
+    db.conn.commit()
+
+
+class PartWriter:
+    """Writes the rows extracted by a worker process to a "part" of its own -- a SQLite
+    database, or a directory of CSV files, in `parts_dir` -- which is merged into the
+    output at the end of the run, so that rows needn't be sent back to the parent
+    process to be written."""
+
+    def __init__(
+        self,
+        parts_dir,
+        output_type,
+        config,
+        logger,
+        sqlite_max_vars=None,
+        sqlite_insert_engine="multi_values",
+    ):
+        self.output_type = output_type
+        self.logger = logger
+        self.fieldnames = get_fieldnames_from_config(config)
+        part_path = Path(parts_dir) / f"part-{os.getpid()}"
+
+        if output_type == "sqlite":
+            self.db = SqliteDB(
+                part_path.with_suffix(".sqlite"),
+                max_vars=sqlite_max_vars,
+                insert_engine=sqlite_insert_engine,
+            )
+            init_sqlite_tables(self.db, config)
+        else:
+            self.output_path = part_path
+            self.output_path.mkdir()
+
+    def write_tables(self, tables):
+        """Write (and commit) `tables`, and return the number of rows written."""
+        # (at debug level, since every worker writes once per task -- the merge of the
+        #  parts is reported instead)
+        if self.output_type == "csv":
+            write_csv_files(
+                self.output_path, self.fieldnames, tables, self.logger, logging.DEBUG
+            )
+
+        if self.output_type == "sqlite":
+            write_sqlitedb(self.db, self.fieldnames, tables, self.logger, logging.DEBUG)
+
+        return sum(map(len, tables.values()))
+
+
 class XmlCollectionToTabular:
     def __init__(
         self,
@@ -34,6 +261,22 @@ class XmlCollectionToTabular:
         processes=None,
         continue_on_error=False,
         sqlite_max_vars=None,
+        preprocess_bytes=None,
+        batch_size=None,
+        flush_rows=FLUSH_ROWS,
+        flush_bytes=FLUSH_BYTES,
+        max_in_flight=None,
+        sqlite_insert_engine="multi_values",
+        parallel_gzip=False,
+        index_dir=None,
+        doc_index=False,
+        interleave_files=False,
+        shard_index=None,
+        shard_count=None,
+        shard_by="ordinal",
+        worker_output=False,
+        background_writer=True,
+        engine="tree",
     ):
 
         self.logger = logging.getLogger(__name__)
@@ -51,6 +294,13 @@ class XmlCollectionToTabular:
                     self.xml_files.extend(
                         path.glob(f'{"**/" if recurse else ""}*.[xX][mM][lL]')
                     )
+                    # XML files in zip and tar archives are read without extracting
+                    self.xml_files.extend(
+                        child
+                        for child in path.glob(f'{"**/" if recurse else ""}*')
+                        if child.name.lower().endswith(ARCHIVE_SUFFIXES)
+                        and child.is_file()
+                    )
                 else:
                     self.logger.fatal("specified input is invalid")
                     exit(1)
@@ -63,7 +313,11 @@ class XmlCollectionToTabular:
         self.output_path = output_path
 
         if self.output_type == "sqlite" and self.output_path == ":memory:":
-            self.init_sqlite_db(self.output_path, max_vars=sqlite_max_vars)
+            self.init_sqlite_db(
+                self.output_path,
+                max_vars=sqlite_max_vars,
+                insert_engine=sqlite_insert_engine,
+            )
 
         elif self.output_type == "sqlite":
             self.output_path = Path(self.output_path).resolve()
@@ -85,7 +339,11 @@ class XmlCollectionToTabular:
             else:
                 self.output_path.parent.mkdir(parents=True, exist_ok=True)
 
-            self.init_sqlite_db(self.output_path, max_vars=sqlite_max_vars)
+            self.init_sqlite_db(
+                self.output_path,
+                max_vars=sqlite_max_vars,
+                insert_engine=sqlite_insert_engine,
+            )
 
         else:
             self.output_path = Path(self.output_path).resolve()
@@ -93,18 +351,70 @@ class XmlCollectionToTabular:
 
         self.dtd_path = dtd_path
         self.preprocess_doc = preprocess_doc
+        self.preprocess_bytes = preprocess_bytes
         self.validate = validate
         self.processes = processes
         self.continue_on_error = continue_on_error
         self.check_doctype = check_doctype
+        # see XmlDocToTabular
+        self.engine = engine
+        # documents are sent to workers in batches of `batch_size` documents, or, by
+        #  default, in batches sized according to the size of the documents and of their
+        #  input (see get_batch_bytes())
+        self.batch_size = batch_size
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        # the number of batches which may be queued for or held by workers at once
+        #  (defaults to four per worker process)
+        self.max_in_flight = max_in_flight
+        # multi-member gzip files may be decompressed and split by several workers at
+        #  once; sidecar indexes are written alongside input files, or in `index_dir`
+        self.parallel_gzip = parallel_gzip
+        self.index_dir = index_dir
+        # with `doc_index`, the offsets of the documents in (uncompressed) input files
+        #  are kept in sidecar indexes, so that later runs needn't scan for them, and
+        #  workers read documents from the files themselves
+        self.doc_index = doc_index
+        # with `interleave_files`, documents from all the input files share a single
+        #  work queue (largest files first), rather than each file being processed (and
+        #  written) in turn
+        self.interleave_files = interleave_files
+        # with `shard_count`, only the documents of shard `shard_index` (of documents
+        #  across all the inputs, see shards.py) are processed, so that a run can be
+        #  divided between several nodes, and their outputs merged afterwards
+        if shard_count is not None:
+            assert (
+                shard_index is not None and 0 <= shard_index < shard_count
+            ), "shard_index must be between 0 and shard_count - 1"
+            assert shard_by in SHARD_BY, f"shard_by must be one of {', '.join(SHARD_BY)}"
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.shard_by = shard_by
+        # with `worker_output`, each worker writes the rows it extracts to its own
+        #  SQLite database or CSV files, which are merged into the output at the end of
+        #  the run (so rows from different workers aren't interleaved in the output)
+        self.worker_output = worker_output
+        self.sqlite_max_vars = sqlite_max_vars
+        # with `background_writer`, rows are written by a thread of their own (which
+        #  then has sole use of the database), while results are collected from workers
+        self.background_writer = background_writer
+        self.table_writer = None
+        self.sqlite_insert_engine = sqlite_insert_engine
+        # see filter_payloads()
+        self.doc_checker = None
 
         self.fieldnames = get_fieldnames_from_config(self.config)
-        if check_doctype:
+        self.doc_filter = (
+            DocFilter(self.config["<filter>"]) if "<filter>" in self.config else None
+        )
+        if check_doctype and "<record_element>" not in self.config:
             self.set_root_element()
 
     def set_root_element(self):
         if "<root_element>" not in self.config:
-            self.config["<root_element>"] = next(iter(self.config.keys()))
+            self.config["<root_element>"] = next(
+                key for key in self.config if not key.startswith("<")
+            )
             self.logger.warning(
                 colored(
                     "<root_element> not explicitly set in config -- assuming <%s/>",
@@ -113,119 +423,316 @@ class XmlCollectionToTabular:
                 self.config["<root_element>"],
             )
 
-    def init_sqlite_db(self, output_path, max_vars):
-        self.db = SqliteDB(output_path, max_vars=max_vars)
-
-        for tablename, fieldnames in get_fieldnames_from_config(self.config).items():
-            if tablename in self.db.table_names():
-                for fieldname in fieldnames:
-                    if fieldname not in self.db[tablename].columns:
-                        self.db[tablename].add_column(fieldname, str)
-                continue
-            params = {"column_order": fieldnames}
-            if "id" in fieldnames:
-                params["pk"] = "id"
-            self.db[tablename].create(
-                {fieldname: str for fieldname in fieldnames}, **params
-            )
+    def init_sqlite_db(self, output_path, max_vars, insert_engine="multi_values"):
+        self.db = SqliteDB(output_path, max_vars=max_vars, insert_engine=insert_engine)
+        init_sqlite_tables(self.db, self.config)
+
+    def get_doc_parser_kwargs(self):
+        return {
+            "logger": self.logger,
+            "config": self.config,
+            "dtd_path": self.dtd_path,
+            "preprocess_doc": self.preprocess_doc,
+            "preprocess_bytes": self.preprocess_bytes,
+            "validate": self.validate,
+            "continue_on_error": self.continue_on_error,
+            "check_doctype": self.check_doctype,
+            "engine": self.engine,
+            "tuple_rows": True,
+        }
 
     def convert(self):
         if not self.xml_files:
             self.logger.warning(colored("No input files to process!", "red"))
 
-        docParser = XmlDocToTabular(
-            logger=self.logger,
-            config=self.config,
-            dtd_path=self.dtd_path,
-            preprocess_doc=self.preprocess_doc,
-            validate=self.validate,
-            continue_on_error=self.continue_on_error,
-            check_doctype=self.check_doctype,
-        )
+        if self.output_type == "sqlite" and self.db is None:
+            # (closed at the end of a previous run)
+            self.init_sqlite_db(
+                self.output_path,
+                max_vars=self.sqlite_max_vars,
+                insert_engine=self.sqlite_insert_engine,
+            )
 
-        for input_file in self.xml_files:
+        processes = self.get_processes()
+        max_in_flight = self.max_in_flight or processes * 4
 
-            self.logger.warning(
-                colored("Processing %s...", "green"), input_file.resolve()
+        parts_dir = part_writer_kwargs = None
+        if self.worker_output:
+            parts_dir = Path(
+                tempfile.mkdtemp(
+                    prefix=".xmltotabular-parts-", dir=self.get_parts_root()
+                )
             )
+            part_writer_kwargs = {
+                "parts_dir": parts_dir,
+                "output_type": self.output_type,
+                "config": self.config,
+                "logger": self.logger,
+                "sqlite_max_vars": self.sqlite_max_vars,
+                "sqlite_insert_engine": self.sqlite_insert_engine,
+            }
+
+        try:
+            # a single pool serves all the input files; on errors, leaving the context
+            #  manager terminates the workers
+            if self.background_writer and not self.worker_output:
+                self.table_writer = BackgroundWriter(self.write_tables)
+
+            with Pool(
+                processes=processes,
+                initializer=init_worker,
+                initargs=(self.get_doc_parser_kwargs(), part_writer_kwargs),
+            ) as pool:
+                if self.interleave_files:
+                    self.process_tasks(pool, self.yield_all_tasks(), max_in_flight)
+                else:
+                    for input_file in self.xml_files:
+                        self.logger.warning(
+                            colored("Processing %s...", "green"), input_file.resolve()
+                        )
+                        self.process_tasks(
+                            pool, self.yield_tasks(input_file), max_in_flight
+                        )
+
+                pool.close()
+                # workers exit (releasing their parts) once all the tasks are done
+                pool.join()
+
+            if self.table_writer is not None:
+                self.table_writer.close()
+                self.table_writer = None
+
+            if parts_dir is not None:
+                self.merge_parts(parts_dir)
+        finally:
+            if self.table_writer is not None:
+                self.table_writer.close(cancel=True)
+                self.table_writer = None
+            if parts_dir is not None:
+                shutil.rmtree(parts_dir, ignore_errors=True)
 
-            processes = self.processes or cpu_count() - 1 or 1
-            # chunk sizes greater than 1 result in duplicate returns because the results
-            #  are pooled on the XmlDocToTabular instance
-            chunksize = 1
+        if self.output_type == "sqlite":
+            if self.output_path == ":memory:":
+                return self.db
+            # the database is held in exclusive locking mode for as long as it's open,
+            #  so is closed once written (so that it can be read, or merged with others),
+            #  and reopened by the next call
+            self.db.close()
+            self.db = None
+
+    def get_processes(self):
+        return self.processes or cpu_count() - 1 or 1
+
+    def get_parts_root(self):
+        """Return the directory in which workers' parts are written: alongside the
+        output, so that they're on the same filesystem."""
+        if self.output_type == "sqlite":
+            if self.output_path == ":memory:":
+                return None
+            return self.output_path.parent
+        return self.output_path
 
-            pool = Pool(processes=processes)
+    def merge_parts(self, parts_dir):
+        self.logger.info(
+            colored("Merging worker output from %s ...", "green"), parts_dir
+        )
+        if self.output_type == "sqlite":
+            # merge_sqlite_into() manages its own transactions, so needs the connection
+            #  in autocommit mode (which in-memory databases aren't opened in)
+            conn = self.db.conn
+            isolation_level = conn.isolation_level
+            conn.isolation_level = None
+            try:
+                merge_sqlite_into(conn, sorted(parts_dir.glob("*.sqlite")))
+            finally:
+                conn.isolation_level = isolation_level
+            self.db.invalidate_schema()
+        else:
+            merge_csv_dirs(
+                self.output_path, sorted(p for p in parts_dir.iterdir() if p.is_dir())
+            )
 
-            all_tables = defaultdict(list)
-            for i, tables in enumerate(
-                pool.imap(
-                    docParser.process_doc_from_pool,
-                    yield_xml_doc(input_file),
-                    chunksize,
-                )
-            ):
+    def process_tasks(self, pool, tasks, max_in_flight):
+        limiter = InFlightLimiter(max_in_flight)
+        pending_tables = defaultdict(list)
+        pending_rows = pending_bytes = num_docs = num_rows = 0
+        # documents skipped by workers (see check_payloads_in_worker())
+        num_filtered = num_rejected = 0
 
-                if i % 100 == 0:
-                    self.logger.info(colored("Processing document %d...", "cyan"), i + 1)
-                for key, value in tables.items():
-                    all_tables[key].extend(value)
+        try:
+            for batch_len, batch_bytes, tables, num_skipped in pool.imap(
+                process_task_in_worker, limiter.feed(tasks)
+            ):
+                limiter.release()
+                num_filtered += num_skipped[0]
+                num_rejected += num_skipped[1]
+
+                if num_docs // 100 < (num_docs + batch_len) // 100 or not num_docs:
+                    self.logger.info(
+                        colored("Processing document %d...", "cyan"),
+                        num_docs + batch_len,
+                    )
+                num_docs += batch_len
 
-            pool.close()
-            pool.join()
+                if self.worker_output:
+                    # the worker has written the rows itself, and returned their number
+                    num_rows += tables
+                    continue
 
-            self.logger.info(colored("...%d documents processed!", "green"), i + 1)
-            if all_tables:
-                self.write_tables(all_tables)
-            else:
-                self.logger.warning(
-                    colored("No rows found! (config file error?)", "red")
+                for key, value in tables.items():
+                    pending_tables[key].extend(value)
+                    pending_rows += len(value)
+                pending_bytes += batch_bytes
+
+                if pending_rows >= self.flush_rows or pending_bytes >= self.flush_bytes:
+                    self.flush_tables(pending_tables)
+                    num_rows += pending_rows
+                    pending_tables = defaultdict(list)
+                    pending_rows = pending_bytes = 0
+        finally:
+            limiter.close()
+
+        self.logger.info(colored("...%d documents processed!", "green"), num_docs)
+        self.log_skipped(num_filtered, num_rejected)
+        if pending_rows:
+            self.flush_tables(pending_tables)
+            num_rows += pending_rows
+
+        if not num_rows:
+            self.logger.warning(colored("No rows found! (config file error?)", "red"))
+
+    def yield_all_tasks(self):
+        """Yield tasks for all the input files, largest first, so that the documents of a
+        large file aren't left to the end of the run (longest-processing-time-first
+        scheduling) -- there's no barrier between files, so the work queue holds
+        documents from several files at a time."""
+        for input_file in sorted(
+            self.xml_files, key=lambda path: path.stat().st_size, reverse=True
+        ):
+            self.logger.warning(colored("Queueing %s...", "green"), input_file.resolve())
+            yield from self.yield_tasks(input_file)
+
+    def yield_tasks(self, input_file):
+        if (
+            self.doc_index
+            and "<record_element>" not in self.config
+            and is_mappable(input_file)
+        ):
+            entries = load_doc_index(input_file, cache_dir=self.index_dir)
+            if self.shard_count is not None:
+                entries = select_shard_entries(
+                    entries,
+                    input_file,
+                    self.shard_index,
+                    self.shard_count,
+                    self.shard_by,
                 )
+            batch_bytes = get_batch_bytes(
+                sum(entry.length for entry in entries), self.get_processes()
+            )
+            for doc_range in yield_doc_ranges(
+                input_file, entries, self.batch_size, batch_bytes
+            ):
+                yield process_doc_range_in_worker, doc_range
+            return
+
+        if (
+            self.parallel_gzip
+            and "<record_element>" not in self.config
+            # documents are assigned to shards as they're split from their input, so
+            #  sharded runs decompress gzip files serially
+            and self.shard_count is None
+            and is_gzip(input_file)
+            and not is_archive(input_file)
+        ):
+            gzip_ranges = list(yield_gzip_ranges(input_file, cache_dir=self.index_dir))
+            if len(gzip_ranges) > 1:
+                for gzip_range in gzip_ranges:
+                    yield process_gzip_range_in_worker, gzip_range
+                return
+            self.logger.debug(
+                "%s is a single gzip member, and will be decompressed serially",
+                input_file,
+            )
 
-        if self.output_type == "sqlite" and self.output_path == ":memory:":
-            return self.db
-
-    def write_tables(self, tables):
-        if self.output_type == "csv":
-            self.write_csv_files(tables)
+        payloads = self.yield_payloads(input_file)
+        if self.shard_count is not None:
+            payloads = yield_shard_payloads(
+                payloads, input_file, self.shard_index, self.shard_count, self.shard_by
+            )
+        if self.doc_filter is not None or (
+            self.check_doctype and "<record_element>" not in self.config
+        ):
+            payloads = self.filter_payloads(payloads, input_file)
+        # (for compressed inputs, the size of the documents is underestimated, so their
+        #  batches are only smaller)
+        batch_bytes = get_batch_bytes(input_file.stat().st_size, self.get_processes())
+        for batch in batch_payloads(payloads, self.batch_size, batch_bytes):
+            yield process_batch_in_worker, batch
+
+    def filter_payloads(self, payloads, input_file):
+        """Apply the `<filter>` in the config, and check the DOCTYPE declaration of each
+        document, as documents are split from the input, so that those which would be
+        skipped are never sent to workers (or parsed at all).  The DOCTYPE check reads
+        only the prolog of each document, so is cheap enough to be made here."""
+        if self.doc_checker is None:
+            self.doc_checker = XmlDocToTabular(**self.get_doc_parser_kwargs())
+
+        num_filtered = num_rejected = 0
+        for payload in payloads:
+            if self.doc_filter is not None and not self.doc_filter.matches(
+                payload["doc"]
+            ):
+                num_filtered += 1
+            elif (
+                self.check_doctype
+                and "<record_element>" not in self.config
+                and not self.doc_checker.do_doctype_check(
+                    payload["doc"], payload["filename"], payload["linenum"]
+                )
+            ):
+                num_rejected += 1
+            else:
+                payload["checked"] = True
+                yield payload
 
-        if self.output_type == "sqlite":
-            self.write_sqlitedb(tables)
+        self.log_skipped(num_filtered, num_rejected, input_file)
 
-    def write_csv_files(self, tables):
+    def log_skipped(self, num_filtered, num_rejected, input_file=None):
+        where = f" in {input_file}" if input_file is not None else ""
+        if num_filtered:
+            self.logger.warning(
+                colored("%d documents%s skipped by <filter>", "yellow"),
+                num_filtered,
+                where,
+            )
+        if num_rejected:
+            self.logger.warning(
+                colored("%d documents%s failed the DOCTYPE check", "yellow"),
+                num_rejected,
+                where,
+            )
 
-        self.logger.info(
-            "%s",
-            colored(f"Writing csv files to {self.output_path.resolve()} ...", "green"),
-        )
-        for tablename, rows in tables.items():
-            output_file = self.output_path / f"{tablename}.csv"
+    def yield_payloads(self, input_file):
+        if "<record_element>" in self.config:
+            # stream records out of a single (large) document
+            return yield_xml_records(
+                input_file, self.config["<record_element>"], self.dtd_path
+            )
+        return yield_xml_doc(input_file)
 
-            if output_file.exists():
-                self.logger.debug(
-                    "%s",
-                    colored(
-                        f"CSV file {output_file} exists; rows will be appended.",
-                        "yellow",
-                    ),
-                )
+    def flush_tables(self, tables):
+        """Write `tables`, or hand them to the background writer (if there is one)."""
+        if self.table_writer is not None:
+            self.table_writer.put(tables)
+        else:
+            self.write_tables(tables)
 
-                with output_file.open("a") as _fh:
-                    writer = csv.DictWriter(_fh, fieldnames=self.fieldnames[tablename])
-                    writer.writerows(rows)
+    def write_tables(self, tables):
+        """Write `tables`, whose rows may be tuples (as the workers return them) or
+        dicts, to the output."""
+        if self.output_type == "csv":
+            write_csv_files(self.output_path, self.fieldnames, tables, self.logger)
 
-            else:
-                with output_file.open("w") as _fh:
-                    writer = csv.DictWriter(_fh, fieldnames=self.fieldnames[tablename])
-                    writer.writeheader()
-                    writer.writerows(rows)
-
-    def write_sqlitedb(self, tables):
-        self.logger.info(colored("Writing tables to %s ...", "green"), self.output_path)
-        self.db.conn.execute("begin exclusive;")
-        for tablename, rows in tables.items():
-            self.logger.info(
-                colored("Writing %d rows to `%s`...", "magenta"),
-                len(rows),
-                tablename,
-            )
-            self.db[tablename].insert_all(rows)
+        if self.output_type == "sqlite":
+            write_sqlitedb(self.db, self.fieldnames, tables, self.logger)
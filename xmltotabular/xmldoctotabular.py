@@ -2,20 +2,36 @@ import logging
 import re
 from collections import defaultdict
 from functools import partial
-from io import BytesIO
 from pprint import pformat
 
 from lxml import etree
 
+from . import plan
+from .plan import NotSimplePath, compile_plan
+from .streaming import (
+    STREAM_CHUNK_BYTES,
+    compile_record_path,
+    get_record_tag,
+    is_record,
+)
 from .utils import (
-    DTDResolver,
+    CachingDTDResolver,
     colored,
     test_doctype,
     WrongDoctypeException,
     NoDoctypeException,
+    DocFilter,
+    has_internal_subset,
 )
 
 
+# Documents may be parsed into a tree, to which the XPath expressions of the config are
+#  applied ("tree"), or, if the config is of records found by simple child paths (see
+#  streaming.py), parsed in chunks, with each record processed, and then discarded, as
+#  soon as it's been parsed, so that the whole tree is never held at once ("stream").
+ENGINES = ("tree", "stream")
+
+
 class XmlDocToTabular:
     def __init__(
         self,
@@ -27,7 +43,12 @@ class XmlDocToTabular:
         continue_on_error=False,
         check_doctype=False,
         log_level=None,
+        preprocess_bytes=None,
+        engine="tree",
+        tuple_rows=False,
     ):
+        assert engine in ENGINES, f"engine must be one of {', '.join(ENGINES)}"
+
         if logger:
             self.logger = logger
         else:
@@ -40,30 +61,100 @@ class XmlDocToTabular:
         self.config = config
         self.dtd_path = dtd_path
         self.preprocess_doc = preprocess_doc
+        self.preprocess_bytes = preprocess_bytes
         self.validate = validate
         self.continue_on_error = continue_on_error
         self.check_doctype = check_doctype
+        # documents may be selected, before they're parsed, by patterns in their bytes
+        self.doc_filter = DocFilter(config["<filter>"]) if "<filter>" in config else None
+        # compiled extraction plans, by namespace map
+        self.plans = {}
+        # the parser (and its DTD resolver) is created once and reused for every
+        #  document, as are DTDs loaded for validation (by system URL); documents with
+        #  an internal DTD subset are validated as they're parsed, by a parser of their
+        #  own
+        self.parser = self.validating_parser = self.resolver = None
+        self.dtds = {}
+        # documents fall back to the tree engine if the config can't be streamed (or
+        #  documents are to be validated, which needs a tree); RecordPaths (or None, for
+        #  plans whose records can't be streamed) are kept by namespace map
+        self.engine = engine
+        self.record_tag = get_record_tag(config) if engine == "stream" else None
+        self.record_paths = {}
+        # records may be kept as tuples of the values of the fields of their tables, in
+        #  the order of `plan.fieldnames`, rather than as dicts (which are smaller, and
+        #  quicker to pickle and to write)
+        self.tuple_rows = tuple_rows
+        self.reset()
+
+    def __getstate__(self):
+        # parsers, DTDs and compiled XPath expressions can't be pickled
+        state = self.__dict__.copy()
+        state.update(
+            {
+                "plans": {},
+                "parser": None,
+                "validating_parser": None,
+                "resolver": None,
+                "dtds": {},
+                "record_paths": {},
+            }
+        )
+        return state
+
+    def reset(self):
+        """Discard the tables and any other per-document state accumulated by previous
+        calls to `process_doc()`."""
         self.tables = defaultdict(list)
         # lambdas can't be pickled (without dill, at least)
         self.table_pk_idx = defaultdict(partial(defaultdict, int))
+        self.ns_map = None
 
     @staticmethod
     def get_text(xpath_result):
+        """Return the text of an XPath result -- for an element, all the text within
+        it, and its tail -- with whitespace normalized."""
         if isinstance(xpath_result, str):
-            return re.sub(r"\s+", " ", xpath_result).strip()
-        return re.sub(
-            r"\s+", " ", etree.tostring(xpath_result, method="text", encoding="unicode")
-        ).strip()
+            # attribute values and text nodes
+            text = xpath_result
+        elif not isinstance(xpath_result.tag, str):
+            # comments and processing instructions
+            text = etree.tostring(xpath_result, method="text", encoding="unicode")
+        elif not len(xpath_result):
+            # (most fields are leaf elements, whose text needn't be serialized)
+            text = (xpath_result.text or "") + (xpath_result.tail or "")
+        else:
+            text = "".join(xpath_result.itertext()) + (xpath_result.tail or "")
+        return " ".join(text.split())
 
     def resolve_namespaces_in_xpath(self, expression):
-
-        if "_" in self.ns_map:
-            expression = "/".join(
-                f"_:{_}" if ":" not in _ and _[0] not in "@[" else _
-                for _ in expression.split("/")
+        return plan.resolve_namespaces_in_xpath(expression, self.ns_map)
+
+    def set_ns_map(self, nsmap):
+        """Set the namespaces of the document from those of its root element (unless
+        they've already been set, by a previous document)."""
+        if self.ns_map is None:
+            self.ns_map = {k if k else "_": v for k, v in nsmap.items()}
+            self.ns_map_reversed = {v: k for k, v in self.ns_map.items()}
+
+    def get_plan(self):
+        key = tuple(sorted(self.ns_map.items()))
+        if key not in self.plans:
+            self.plans[key] = compile_plan(self.config, self.ns_map)
+        return self.plans[key]
+
+    def get_prefixed_tag(self, tag):
+        """Return `tag` with any namespace in Clark notation replaced by its prefix."""
+        if not self.ns_map:
+            return tag
+        prefixed_tags = self.current_plan.prefixed_tags
+        if tag not in prefixed_tags:
+            prefixed_tags[tag] = re.sub(
+                r"^{([^}]+)}",
+                lambda m: f"{self.ns_map_reversed[m.group(1)]}:",
+                tag,
             )
-
-        return expression
+        return prefixed_tags[tag]
 
     def get_pk(self, tree, config):
         def get_pk_component(expression):
@@ -85,16 +176,30 @@ class XmlDocToTabular:
         return None
 
     def process_doc_from_pool(self, payload):
-        """Unpack a tuple returned by yield_xml_doc().
+        """Unpack a tuple returned by yield_xml_doc(), and return the tables for that
+        document alone.
 
         This is necessary because multiprocessing.Pool.imap will only pass a single
         argument to child processes. Pool.starmap would be great, but there's no version
         that works with iterables, which is really needed here. Pathos' multiprocess can
         handle this (and is required by this library when using python 3.6 anyway) --
         there may be value in using this anyway.
+
+        Since the same instance processes many documents in each worker process, state
+        from previous documents is discarded first.
         """
+        self.reset()
         return self.process_doc(**payload)
 
+    def process_docs_from_pool(self, payloads):
+        """As process_doc_from_pool(), for a batch of payloads; returns the tables for
+        the documents in the batch."""
+        tables = defaultdict(list)
+        for payload in payloads:
+            for key, rows in self.process_doc_from_pool(payload).items():
+                tables[key].extend(rows)
+        return tables
+
     def do_doctype_check(self, doc, filename, linenum):
         try:
             test_doctype(doc, self.config["<root_element>"])
@@ -135,36 +240,55 @@ class XmlDocToTabular:
 
             return False
 
-    def process_doc(self, doc, filename=None, linenum=None):
-        if self.check_doctype and not self.do_doctype_check(doc, filename, linenum):
-            # doctype check failed, but continue_on_error is True
+    def check_doc(self, doc, filename=None, linenum=None):
+        """Return True if `doc` should be processed: i.e., if it matches the `<filter>`
+        in the config (if any), and passes the DOCTYPE check (if enabled)."""
+        if self.doc_filter is not None and not self.doc_filter.matches(doc):
+            return False
+
+        # records streamed from a larger document (see `<record_element>`) don't have
+        #  a DOCTYPE of their own
+        return (
+            not self.check_doctype
+            or "<record_element>" in self.config
+            or self.do_doctype_check(doc, filename, linenum)
+        )
+
+    def process_doc(self, doc, filename=None, linenum=None, checked=False):
+        # `checked` is set if check_doc() has already been passed (e.g. when documents
+        #  are checked as they're split from their input file)
+        if not checked and not self.check_doc(doc, filename, linenum):
+            # filtered out, or the doctype check failed but continue_on_error is True
             return self.tables
 
         try:
-            tree = self.parse_tree(doc)
+            tree = None
+            if self.record_tag is not None and not self.validate:
+                tree = self.parse_stream(doc, filename)
 
-            try:
-                tree = tree.getroot()
-            except AttributeError:
-                pass
+            if tree is None:
+                tree = self.parse_tree(doc)
+
+                try:
+                    tree = tree.getroot()
+                except AttributeError:
+                    pass
 
-            if self.__dict__.get("ns_map", None) is None:
-                self.ns_map = {
-                    k if k is not None else "_": v for k, v in tree.nsmap.items()
-                }
-                self.ns_map_reversed = {v: k for k, v in self.ns_map.items()}
+            self.set_ns_map(tree.nsmap)
+            self.current_plan = self.get_plan()
 
-            for path, config in self.config.items():
-                if path == "<root_element>":
-                    continue
-                self.process_path(tree, path, config, filename, {})
+            prefix_cache = {}
+            for path_plan in self.current_plan.paths:
+                self.process_path(
+                    tree, path_plan, filename, {}, prefix_cache=prefix_cache
+                )
 
         except LookupError as exc:
             self.logger.warning(exc.args[0])
             if not self.continue_on_error:
                 raise SystemExit() from None
 
-        except etree.XMLSyntaxError as exc:
+        except (etree.XMLSyntaxError, etree.DocumentInvalid) as exc:
             self.logger.warning(
                 colored(
                     "Unable to parse XML document"
@@ -173,7 +297,7 @@ class XmlDocToTabular:
                     + " (enable debug logging to dump doc to console):",
                     "red",
                 )
-                + colored(f"\n    {exc.msg}", "yellow")
+                + colored(f"\n    {getattr(exc, 'msg', exc)}", "yellow")
             )
             self.logger.debug(doc)
 
@@ -192,7 +316,7 @@ class XmlDocToTabular:
                     + " (enable debug logging to dump doc to console):",
                     "red",
                 )
-                + colored(f"\n    {exc.msg}", "yellow")
+                + colored(f"\n    {exc}", "yellow")
             )
             self.logger.debug(doc)
 
@@ -201,110 +325,265 @@ class XmlDocToTabular:
 
         return self.tables
 
-    def parse_tree(self, doc):
+    def prepare_doc(self, doc):
+        """Return a document, passed as bytes (in which case the parser takes care of
+        decoding it according to its declared encoding) or as a string, as bytes ready
+        to be parsed.
+
+        `preprocess_bytes` is applied to documents passed as bytes; if `preprocess_doc`
+        is set, documents are decoded so that it always receives a string.
+        """
+        if self.preprocess_bytes and isinstance(doc, bytes):
+            doc = self.preprocess_bytes(doc)
+
         if self.preprocess_doc:
+            if isinstance(doc, bytes):
+                doc = doc.decode("utf8", errors="replace")
             doc = self.preprocess_doc(doc)
 
-        parser_args = {
-            "load_dtd": True,
-            "resolve_entities": True,
-            "ns_clean": True,
-            "huge_tree": True,
-            "collect_ids": False,
-        }
+        if isinstance(doc, str):
+            doc = doc.encode("utf8")
 
-        if self.validate:
-            parser_args["dtd_validation"] = True
+        return doc
 
-        parser = etree.XMLParser(**parser_args)
-        if self.dtd_path:
-            parser.resolvers.add(DTDResolver(self.dtd_path))
-        return etree.parse(BytesIO(doc.encode("utf8")), parser)
+    def parse_tree(self, doc):
+        doc = self.prepare_doc(doc)
+        # an internal subset may add to an external DTD, so the external DTD alone
+        #  (which validate_tree() would use) can't be used to validate the document
+        validating = self.validate and has_internal_subset(doc)
+        parser = self.get_parser(validating)
 
-    def process_path(
-        self, tree, path, config, filename, record, parent_entity=None, parent_pk=None
-    ):
-        path = self.resolve_namespaces_in_xpath(path)
-        tag = tree.tag
-        if self.ns_map:
-            tag = re.sub(
-                r"^{([^}]+)}",
-                lambda m: f"{self.ns_map_reversed[m.group(1)]}:",
-                tree.tag,
+        try:
+            tree = etree.fromstring(doc, parser)
+        except etree.XMLSyntaxError:
+            # undecodable bytes used to be replaced when input was read as text, so
+            #  fall back to that for documents which aren't valid UTF-8
+            repaired = doc.decode("utf8", errors="replace").encode("utf8")
+            if repaired == doc:
+                raise
+            tree = etree.fromstring(repaired, parser)
+
+        if self.validate and not validating:
+            self.validate_tree(tree)
+
+        return tree
+
+    def get_resolver(self):
+        if self.resolver is None:
+            self.resolver = CachingDTDResolver(self.dtd_path)
+        return self.resolver
+
+    def get_parser(self, validating=False):
+        """Return the parser, or the validating parser, creating it on first use.  Both
+        share the DTD resolver, so DTDs are read from disk only once for both."""
+        parser = self.validating_parser if validating else self.parser
+        if parser is None:
+            parser = etree.XMLParser(
+                load_dtd=True,
+                dtd_validation=validating,
+                resolve_entities=True,
+                ns_clean=True,
+                huge_tree=True,
+                collect_ids=False,
             )
+            parser.resolvers.add(self.get_resolver())
+            if validating:
+                self.validating_parser = parser
+            else:
+                self.parser = parser
+        return parser
+
+    def parse_stream(self, doc, filename):
+        """Parse a document with the streaming engine (see streaming.py), processing its
+        records as they're parsed, and return its root element, from which those records
+        have been removed (so that applying the plan to it finds nothing more), or None
+        if the document should be parsed with parse_tree() instead.  Documents which fail
+        to parse are left to parse_tree() too, to be repaired or reported, and any rows
+        taken from them are discarded."""
+        if len(doc) <= STREAM_CHUNK_BYTES:
+            return None
+        doc = self.prepare_doc(doc)
+
+        parser = etree.XMLPullParser(
+            events=("end",),
+            tag=self.record_tag,
+            load_dtd=True,
+            resolve_entities=True,
+            ns_clean=True,
+            huge_tree=True,
+            collect_ids=False,
+        )
+        parser.resolvers.add(self.get_resolver())
 
-        if path == tag:
+        num_rows = {entity: len(rows) for entity, rows in self.tables.items()}
+        pk_idx = {entity: idx.copy() for entity, idx in self.table_pk_idx.items()}
+        record_path = None
+        try:
+            for start in range(0, len(doc), STREAM_CHUNK_BYTES):
+                parser.feed(doc[start : start + STREAM_CHUNK_BYTES])
+                for _event, elem in parser.read_events():
+                    if record_path is None:
+                        record_path = self.get_record_path(elem.getroottree().getroot())
+                        if record_path is None:
+                            # (nothing has been processed yet, so the document can
+                            #  simply be parsed again)
+                            return None
+                    if not is_record(elem, record_path.steps):
+                        continue
+                    self.process_field(elem, record_path.path_plan.action, filename, {})
+                    elem.clear()
+                    elem.getparent().remove(elem)
+            return parser.close()
+
+        except etree.XMLSyntaxError:
+            for entity in list(self.tables):
+                if entity in num_rows:
+                    del self.tables[entity][num_rows[entity] :]
+                else:
+                    del self.tables[entity]
+            self.table_pk_idx.clear()
+            self.table_pk_idx.update(pk_idx)
+            return None
+
+    def get_record_path(self, root):
+        """Set the namespaces and plan for a document being streamed, from its root
+        element, and return the RecordPath of the plan, or None if its records can't be
+        processed as they're parsed."""
+        self.set_ns_map(root.nsmap)
+        self.current_plan = self.get_plan()
+
+        key = tuple(sorted(self.ns_map.items()))
+        if key not in self.record_paths:
+            try:
+                self.record_paths[key] = compile_record_path(self.current_plan)
+            except NotSimplePath:
+                self.record_paths[key] = None
+        record_path = self.record_paths[key]
+
+        # a path which refers to the root element itself has no records (see
+        #  process_path())
+        if record_path is not None and record_path.path_plan.path == (
+            self.get_prefixed_tag(root.tag)
+        ):
+            return None
+        return record_path
+
+    def validate_tree(self, tree):
+        """Validate a parsed document against its DTD, which (if it's an external DTD) is
+        loaded only once.  Raises etree.DocumentInvalid if the document is invalid.
+        Documents with an internal DTD subset are validated by the parser instead (see
+        parse_tree())."""
+        docinfo = tree.getroottree().docinfo
+
+        if docinfo.system_url:
+            if docinfo.system_url not in self.dtds:
+                self.dtds[docinfo.system_url] = etree.DTD(
+                    self.resolver.get_filename(docinfo.system_url)
+                )
+            dtd = self.dtds[docinfo.system_url]
+        else:
+            dtd = docinfo.internalDTD
+
+        if dtd is None:
+            raise etree.DocumentInvalid("Validation failed: no DTD found !")
+        dtd.assertValid(tree)
+
+    def process_path(
+        self,
+        tree,
+        path_plan,
+        filename,
+        record,
+        parent_entity=None,
+        parent_pk=None,
+        prefix_cache=None,
+    ):
+        if path_plan.path == self.get_prefixed_tag(tree.tag):
             results = [tree]
+        elif path_plan.factored is not None and prefix_cache is not None:
+            results = self.get_factored_results(tree, path_plan.factored, prefix_cache)
         else:
-            results = tree.xpath(path, namespaces=self.ns_map)
-            if len(results) > 1 and not any(
-                key in config
-                for key in ("<entity>", "<joiner>", "<enum_map>", "<enum_type>")
-            ):
-                self.logger.warning(
-                    f"Multiple elements found for {path}!  Only the last will be kept! "
-                    + "Should your config file include a joiner, or new entity "
-                    + "definition?"
-                    + "\n\n- "
-                    + "\n- ".join(self.get_text(el) for el in results)
-                )
+            results = path_plan.xpath(tree)
+
+        if len(results) > 1 and path_plan.warn_on_multiple:
+            self.logger.warning(
+                f"Multiple elements found for {path_plan.path}!  Only the last will "
+                + "be kept! Should your config file include a joiner, or new entity "
+                + "definition?"
+                + "\n\n- "
+                + "\n- ".join(self.get_text(el) for el in results)
+            )
 
         for result in results:
             self.process_field(
-                result, config, filename, record, parent_entity, parent_pk
+                result, path_plan.action, filename, record, parent_entity, parent_pk
             )
 
+    @staticmethod
+    def get_factored_results(tree, factored, prefix_cache):
+        """Evaluate a FactoredPath from `tree`: the elements found by its prefix, and
+        their children indexed by tag, are kept in `prefix_cache` (one per context),
+        so that they're found once for all the paths that share the prefix."""
+        if factored.prefix not in prefix_cache:
+            prefix_cache[factored.prefix] = (factored.prefix_xpath(tree), None)
+        nodes, children = prefix_cache[factored.prefix]
+
+        if factored.is_attribute:
+            return [
+                node.get(factored.leaf)
+                for node in nodes
+                if node.get(factored.leaf) is not None
+            ]
+
+        if children is None:
+            children = defaultdict(list)
+            for node in nodes:
+                for child in node:
+                    children[child.tag].append(child)
+            prefix_cache[factored.prefix] = (nodes, children)
+        return children.get(factored.leaf, [])
+
     def process_field(
         self,
         result,
-        config,
+        action,
         filename,
         record,
         parent_entity=None,
         parent_pk=None,
     ):
+        kind = action.kind
 
-        if isinstance(config, str):
-            record[config] = self.get_text(result)
+        if kind == plan.FIELD:
+            record[action.fieldname] = self.get_text(result)
             return
 
-        if "<entity>" in config:
-            # config is a new entity definition (i.e. a new record on a new table/file)
-            self.process_new_entity(result, config, filename, parent_entity, parent_pk)
+        if kind == plan.ENTITY:
+            # a new entity definition (i.e. a new record on a new table/file)
+            self.process_new_entity(result, action, filename, parent_entity, parent_pk)
             return
 
-        if "<fieldname>" in config:
-            # config is extra configuration for a field on this table/file
-            if "<joiner>" in config:
-                if record.get(config["<fieldname>"]):
-                    record[config["<fieldname>"]] += config["<joiner>"] + self.get_text(
-                        result
-                    )
-                else:
-                    record[config["<fieldname>"]] = self.get_text(result)
-                return
-
-            if "<enum_map>" in config:
-                record[config["<fieldname>"]] = config["<enum_map>"].get(
-                    self.get_text(result)
-                )
-                return
+        if kind == plan.JOINER:
+            if record.get(action.fieldname):
+                record[action.fieldname] += action.value + self.get_text(result)
+            else:
+                record[action.fieldname] = self.get_text(result)
+            return
 
-            if "<enum_type>" in config:
-                record[config["<fieldname>"]] = config["<enum_type>"]
-                return
+        if kind == plan.ENUM_MAP:
+            record[action.fieldname] = action.value.get(self.get_text(result))
+            return
 
-            # just an explicit mapping to a fieldname string
-            if len(config) == 1:
-                record[config["<fieldname>"]] = self.get_text(result)
-                return
+        if kind == plan.ENUM_TYPE:
+            record[action.fieldname] = action.value
+            return
 
         # We may have multiple configurations for this key (XPath expression)
-        if isinstance(config, list):
-            for subconfig in config:
+        if kind == plan.MULTIPLE:
+            for subaction in action.actions:
                 self.process_field(
                     result,
-                    subconfig,
+                    subaction,
                     filename,
                     record,
                     parent_entity,
@@ -315,19 +594,33 @@ class XmlDocToTabular:
         raise LookupError(
             f'Invalid configuration for key "{parent_entity}":'
             + "\n "
-            + "\n ".join(pformat(config).split("\n"))
+            + "\n ".join(pformat(action.config).split("\n"))
         )
 
+    def get_pk_from_plan(self, elem, primary_key):
+        components = []
+        for expression, xpath in primary_key:
+            elems = xpath(elem)
+            assert (
+                len(elems) == 1
+            ), f"{len(elems)} elements found for <primary_key> component {expression}"
+            components.append(self.get_text(elems[0]))
+        return "-".join(components)
+
     def process_new_entity(
-        self, elem, config, filename, parent_entity=None, parent_pk=None
+        self, elem, action, filename, parent_entity=None, parent_pk=None
     ):
         """Process a subtree of the xml as a new entity type, creating a new record in a
         new output table/file.
         """
-        entity = config["<entity>"]
+        entity = action.entity
         record = {}
 
-        pk = self.get_pk(elem, config)
+        pk = (
+            self.get_pk_from_plan(elem, action.primary_key)
+            if action.primary_key
+            else None
+        )
         if pk:
             record["id"] = pk
         else:
@@ -336,9 +629,14 @@ class XmlDocToTabular:
 
         if parent_pk:
             record[f"{parent_entity}_id"] = parent_pk
-        if "<filename_field>" in config:
-            record[config["<filename_field>"]] = filename
-        for subpath, subconfig in config["<fields>"].items():
-            self.process_path(elem, subpath, subconfig, filename, record, entity, pk)
+        if action.filename_field:
+            record[action.filename_field] = filename
+        prefix_cache = {}
+        for path_plan in action.fields:
+            self.process_path(
+                elem, path_plan, filename, record, entity, pk, prefix_cache
+            )
 
+        if self.tuple_rows:
+            record = tuple(map(record.get, self.current_plan.fieldnames[entity]))
         self.tables[entity].append(record)